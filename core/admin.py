@@ -1,4 +1,12 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .exports import FORMATS, export_orders
 from .models import (
     Order,
     OrderItem,
@@ -12,11 +20,47 @@ from .models import (
 )
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator taking the row count of large tables from Postgres' stats.
+
+    An unfiltered changelist of a table with more than
+    ADMIN_ESTIMATED_COUNT_THRESHOLD rows shows the planner's estimate
+    instead of running COUNT(*) over all of them.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
 def make_refund_accepted(modeladmin, request, queryset):
     queryset.update(refund_requested=False, refund_granted=True)
 make_refund_accepted.short_description = 'Update orders to refund granted'
 
 
+def make_export_action(export_format):
+    def export(modeladmin, request, queryset):
+        _, content_type = FORMATS[export_format]
+        response = StreamingHttpResponse(
+            export_orders(queryset, export_format), content_type=content_type)
+        filename = f'orders-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    export.__name__ = f'export_orders_{export_format}'
+    export.short_description = f'Export orders as {export_format.upper()}'
+    return export
+
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = [
         'user',
@@ -29,6 +73,7 @@ class OrderAdmin(admin.ModelAdmin):
         'billing_address',
         'payment',
         'coupon',
+        'order_total',
     ]
     
     list_display_links = [
@@ -52,7 +97,30 @@ class OrderAdmin(admin.ModelAdmin):
         'ref_code',
     ]
 
-    actions = [make_refund_accepted]
+    actions = [
+        make_refund_accepted,
+        make_export_action('csv'),
+        make_export_action('jsonl'),
+    ]
+
+    # the __str__ of the addresses and the payment show their user
+    list_select_related = [
+        'user',
+        'shipping_address__user',
+        'billing_address__user',
+        'payment__user',
+        'coupon',
+    ]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    def order_total(self, obj):
+        return obj.computed_total
+    order_total.admin_order_field = 'computed_total'
+    order_total.short_description = 'total'
 
 
 class AddressAdmin(admin.ModelAdmin):
@@ -79,6 +147,10 @@ class AddressAdmin(admin.ModelAdmin):
         'zip',
     ]
 
+    list_select_related = ['user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 class ItemVariationAdmin(admin.ModelAdmin):
     list_display = ['variation', 'value', 'attachment']
@@ -0,0 +1,48 @@
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+
+    # weak comparison, as If-None-Match calls for
+    etags = parse_etags(if_none_match)
+    return '*' in etags or strip_weak(etag) in map(strip_weak, etags)
+
+
+class ConditionalGetMixin:
+    """Answer a GET with 304 when the client already has the current data.
+
+    Views implement get_version(), a cheap stamp of what the response
+    would contain, so an unchanged resource is never loaded or serialized.
+    """
+
+    cache_control = 'no-cache'
+
+    def get_version(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_version(request, *args, **kwargs)
+        if version is None:
+            return super().get(request, *args, **kwargs)
+
+        # the browsable API and JSON renderings differ
+        etag = f'"{version}-{request.accepted_renderer.format}"'
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+        response['ETag'] = etag
+        response['Cache-Control'] = self.cache_control
+        return response
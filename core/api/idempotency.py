@@ -0,0 +1,133 @@
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import IdempotencyKey
+
+
+def request_fingerprint(request):
+    data = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(
+        f'{request.method} {request.path} {data}'.encode()).hexdigest()
+
+
+def expiry():
+    """Keys created before this are expired and can be reused."""
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def purge_expired_keys():
+    """Delete the expired keys. Returns how many were deleted."""
+    return IdempotencyKey.objects.filter(created__lt=expiry()).delete()[0]
+
+
+def claim_key(user, key, fingerprint):
+    """(record, True) for the first request with the key, else (record, False).
+
+    The INSERT is committed right away, so concurrent duplicates see the
+    key and wait for its response instead of running the request again.
+    """
+    while True:
+        # a replay is answered with this single query
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            try:
+                with transaction.atomic():
+                    return IdempotencyKey.objects.create(
+                        user=user, key=key,
+                        request_fingerprint=fingerprint), True
+            except IntegrityError:
+                # a duplicate claimed it first
+                continue
+
+        if record.created < expiry():
+            IdempotencyKey.objects.filter(pk=record.pk,
+                                          created=record.created).delete()
+            continue
+        return record, False
+
+
+def wait_for_response(record):
+    """The record once its response is stored.
+
+    None after IDEMPOTENCY_WAIT_TIMEOUT seconds, or when the request
+    holding the key failed.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while record is not None and record.status_code is None:
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def idempotent(post):
+    """Run a view's POST once per Idempotency-Key header.
+
+    A retried request gets the stored response back without running the
+    view again, a duplicate arriving while the first one runs waits for
+    its response. Requests without the header run as usual.
+
+    Keys only catch retries of the same request, a checkout sent again
+    under a new key is refused by submit_payment() while the order has a
+    payment in flight.
+    """
+    @functools.wraps(post)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return post(view, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'message': 'Idempotency-Key is too long.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        while True:
+            record, created = claim_key(request.user, key, fingerprint)
+            if created:
+                return run_once(record, post, view, request, *args, **kwargs)
+
+            if record.request_fingerprint != fingerprint:
+                return Response({
+                    'message': 'Idempotency-Key was used for another request.'
+                }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+            stored = wait_for_response(record)
+            if stored is not None:
+                response = Response(json.loads(stored.response_body),
+                                    status=stored.status_code)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            if IdempotencyKey.objects.filter(pk=record.pk).exists():
+                return Response({
+                    'message': 'A request with this Idempotency-Key is in '
+                               'progress.'
+                }, status=status.HTTP_409_CONFLICT)
+    return wrapper
+
+
+def run_once(record, post, view, request, *args, **kwargs):
+    try:
+        response = post(view, request, *args, **kwargs)
+    except Exception:
+        # nothing to replay, a retry runs the request again
+        record.delete()
+        raise
+
+    if response.status_code >= 500:
+        record.delete()
+    else:
+        record.status_code = response.status_code
+        record.response_body = json.dumps(response.data, cls=JSONEncoder)
+        record.save(update_fields=['status_code', 'response_body'])
+    return response
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ItemCursorPagination(CursorPagination):
+    # keyset pagination over Item.Meta.ordering, the id breaks ties between
+    # items created at the same instant so cursors stay stable
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class ItemSearchPagination(PageNumberPagination):
+    # search results are ordered by rank, which a cursor can't seek on
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
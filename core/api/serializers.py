@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django_countries.serializer_fields import CountryField
+from core.images import load_renditions, srcset
 from core.models import (
     Item,
     Order,
@@ -12,9 +13,51 @@ from core.models import (
 )
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Only build the fields listed in the `fields` query param."""
+
+    # model columns of the fields not named after one
+    field_columns = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        if request is None:
+            return set()
+
+        fields = request.query_params.get('fields', '')
+        requested = {f.strip() for f in fields.split(',')}
+        return requested & set(cls.Meta.fields)
+
+    @classmethod
+    def get_requested_columns(cls, request):
+        return {column for name in cls.get_requested_fields(request)
+                for column in cls.field_columns.get(name, [name])}
+
+
+class SrcsetField(serializers.Field):
+    """{content type: srcset} of an image's renditions, see core.images."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return srcset(load_renditions(value), self.context.get('request'))
+
+
+class ItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = serializers.SerializerMethodField()
     label = serializers.SerializerMethodField()
+    image_srcset = SrcsetField(source='image_renditions')
+
+    field_columns = {'image_srcset': ['image_renditions']}
 
     class Meta:
         model = Item
@@ -28,6 +71,7 @@ class ItemSerializer(serializers.ModelSerializer):
             'slug',
             'description',
             'image',
+            'image_srcset',
         ]
 
     def get_category(self, obj):
@@ -45,10 +89,12 @@ class VariationDetailSerializer(serializers.ModelSerializer):
 
 class ItemVariationDetailSerializer(serializers.ModelSerializer):
     variation = serializers.SerializerMethodField()
+    attachment_srcset = SrcsetField(source='attachment_renditions')
 
     class Meta:
         model = ItemVariation
-        fields = ['id', 'variation', 'value', 'attachment']
+        fields = ['id', 'variation', 'value', 'attachment',
+                  'attachment_srcset']
 
     def get_variation(self, obj):
         return VariationDetailSerializer(obj.variation).data
@@ -89,7 +135,6 @@ class CouponSerializer(serializers.ModelSerializer):
 
 class OrderSerializer(serializers.ModelSerializer):
     order_items = serializers.SerializerMethodField()
-    total = serializers.SerializerMethodField()
     coupon = CouponSerializer()
 
     class Meta:
@@ -97,6 +142,9 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = [
             'id',
             'order_items',
+            'item_count',
+            'subtotal',
+            'discount',
             'total',
             'coupon'
         ]
@@ -104,14 +152,13 @@ class OrderSerializer(serializers.ModelSerializer):
     def get_order_items(self, obj):
         return OrderItemSerializer(obj.items.all(), many=True).data
 
-    def get_total(self, obj):
-        return obj.get_total()
-
 
 class ItemVariationSerializer(serializers.ModelSerializer):
+    attachment_srcset = SrcsetField(source='attachment_renditions')
+
     class Meta:
         model = ItemVariation
-        fields = ['id', 'value', 'attachment']
+        fields = ['id', 'value', 'attachment', 'attachment_srcset']
 
 
 class VariationSerializer(serializers.ModelSerializer):
@@ -129,6 +176,7 @@ class VariationSerializer(serializers.ModelSerializer):
 class ItemDetailSerializer(serializers.ModelSerializer):
     category = serializers.SerializerMethodField()
     label = serializers.SerializerMethodField()
+    image_srcset = SrcsetField(source='image_renditions')
     variations = serializers.SerializerMethodField()
 
     class Meta:
@@ -143,6 +191,7 @@ class ItemDetailSerializer(serializers.ModelSerializer):
             'slug',
             'description',
             'image',
+            'image_srcset',
             'variations',
         ]
 
@@ -181,5 +230,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = [
             'id',
             'amount',
-            'timestamp'
+            'timestamp',
+            'status',
+            'failure_message'
         ]
@@ -10,6 +10,14 @@ urlpatterns = [
     path('products/<int:pk>/', views.ItemDetailAPIView.as_view(),
          name='product_detail'),
 
+    # catalog cache hit/miss counters
+    path('catalog-cache/stats/', views.CatalogCacheStatsAPIView.as_view(),
+         name='catalog_cache_stats'),
+
+    # per view SQL profile totals
+    path('sql-profile/stats/', views.SQLProfileStatsAPIView.as_view(),
+         name='sql_profile_stats'),
+
     # add to cart
     path('add-to-cart/', views.AddToCartAPIView.as_view(), name='add_to_cart'),
 
@@ -47,13 +55,17 @@ urlpatterns = [
     path('order-items/<int:pk>/delete/', views.OrderItemDeleteAPIView.as_view(),
          name='orderitem_delete'),
 
-    # delete order item
+    # update order item quantity
     path('order-item/update-quantity/',
           views.OrderItemQuantityUpdateAPIView.as_view(),
-          name='orderitem_delete'),
+          name='orderitem_update_quantity'),
 
     # delete order item
     path('payments/',
           views.PaymentListAPIView.as_view(),
           name='payment_list'),
+
+    # payment status
+    path('payments/<int:pk>/', views.PaymentDetailAPIView.as_view(),
+         name='payment_detail'),
 ]
@@ -1,25 +1,23 @@
-import stripe
-from django_countries import countries
 from django.conf import settings
-from django.http import Http404
-from django.utils import timezone
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.translation import gettext_lazy as _
 from rest_framework import generics
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 from core.models import (
     Item,
     OrderItem,
     Order,
-    UserProfile,
     Payment,
     Coupon,
     Variation,
-    ItemVariation,
     Address,
+    cart_prefetch,
 )
 from .serializers import (
     ItemSerializer,
@@ -28,23 +26,99 @@ from .serializers import (
     AddressSerializer,
     PaymentSerializer
 )
+from .conditional import ConditionalGetMixin, etag_matches
+from .idempotency import idempotent
 from .permissions import IsOwner
+from .pagination import ItemCursorPagination, ItemSearchPagination
+from core import catalog_cache
+from core.cart import (
+    CartError, add_to_cart, apply_coupon, delete_line, remove_from_cart,
+)
+from core.countries import rendered_countries
+from core.middleware import profile_stats
+from core.payments import PaymentError, submit_payment
+from core.search import search_items
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
-class ItemListAPIView(generics.ListAPIView):
+class ItemListAPIView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = ItemSerializer
     queryset = Item.objects.all()
     permission_classes = [AllowAny]
+    pagination_class = ItemCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('q'):
+                self._paginator = ItemSearchPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+
+        # only load the columns the client asked for, the cursor
+        # needs the ordering columns as well
+        requested = ItemSerializer.get_requested_columns(self.request)
+        if requested:
+            qs = qs.only('id', 'created_at', *requested)
+
+        q = self.request.query_params.get('q')
+        if q:
+            qs = search_items(qs, q)
+        return qs
+
+    def get_version(self, request, *args, **kwargs):
+        return f'list-{catalog_cache.list_version()}'
 
+    def list(self, request, *args, **kwargs):
+        # search results are not cached, every query would be its own page
+        if request.query_params.get('q'):
+            return super().list(request, *args, **kwargs)
 
-class ItemDetailAPIView(generics.RetrieveAPIView):
+        key = catalog_cache.list_key(request.build_absolute_uri())
+        data = catalog_cache.get_or_set(
+            key, lambda: super(ItemListAPIView, self).list(
+                request, *args, **kwargs).data)
+        return Response(data)
+
+
+class ItemDetailAPIView(ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = ItemDetailSerializer
-    queryset = Item.objects.all()
+    # the whole variation tree loads in two extra queries
+    queryset = Item.objects.prefetch_related(
+        Prefetch('variation_set', queryset=Variation.objects.prefetch_related(
+            'itemvariation_set')))
     permission_classes = [AllowAny]
 
+    def get_version(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        return f'item-{pk}-{catalog_cache.item_version(pk)}'
+
+    def retrieve(self, request, *args, **kwargs):
+        key = catalog_cache.item_key(kwargs['pk'],
+                                     request.build_absolute_uri())
+        data = catalog_cache.get_or_set(
+            key, lambda: super(ItemDetailAPIView, self).retrieve(
+                request, *args, **kwargs).data)
+        return Response(data)
+
+
+class CatalogCacheStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(catalog_cache.stats(), status=status.HTTP_200_OK)
+
+
+class SQLProfileStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        # per worker process, see core.middleware.QueryProfilerMiddleware
+        return Response(profile_stats.snapshot(), status=status.HTTP_200_OK)
+
 
 class AddToCartAPIView(APIView):
     def post(self, request, *args, **kwargs):
@@ -58,70 +132,56 @@ class AddToCartAPIView(APIView):
 
         item = get_object_or_404(Item, slug=slug)
 
-        minimum_variation_count = Variation.objects.filter(item=item).count()
-        if len(variations) < minimum_variation_count:
+        try:
+            add_to_cart(request.user, item, variations)
+        except CartError as e:
             return Response({
-                'message': _('Please specify the required variations')
+                'message': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
-
-        order_item_qs = OrderItem.objects.filter(item=item,
-                                                 user=request.user,
-                                                 ordered=False)
-
-        for v in variations:
-            order_item_qs = order_item_qs.filter(item_variations=v)
-
-        if order_item_qs.exists():
-            order_item = order_item_qs.first()
-            order_item.quantity += 1
-            order_item.save()
-        else:
-            order_item = OrderItem.objects.create(item=item,
-                                                  user=request.user,
-                                                  ordered=False)
-            order_item.item_variations.add(*variations)
-            order_item.save()
-
-        order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-        if order_qs.exists():
-            order = order_qs.first()
-            # check if the order item isn't in the order
-            if not order.items.filter(item__id=order_item.id).exists():
-                order.items.add(order_item)
-            return Response(status.HTTP_200_OK)
-        else:
-            ordered_date = timezone.now()
-            order = Order.objects.create(user=request.user,
-                                         ordered_date=ordered_date)
-            order.items.add(order_item)
-            return Response(status.HTTP_200_OK)
+        return Response(status.HTTP_200_OK)
 
 
-class OrderDetailAPIView(generics.RetrieveAPIView):
+class OrderDetailAPIView(ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    cache_control = 'private, no-cache'
+
+    def get_version(self, request, *args, **kwargs):
+        # the lines are only loaded when the client's copy is outdated
+        self.order = Order.objects.select_related('coupon').filter(
+            user=request.user, ordered=False).first()
+        if self.order is None:
+            return None
+        return f'order-{self.order.pk}-{self.order.revision}'
 
     def get_object(self):
-        try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            return order
-        except Order.DoesNotExist:
+        if self.order is None:
             raise Http404(_("You do not have an active order"))
+        prefetch_related_objects([self.order], cart_prefetch())
+        return self.order
 
 
 class OrderItemDeleteAPIView(generics.DestroyAPIView):
     permission_classes = [IsAuthenticated, IsOwner]
-    queryset = OrderItem.objects.all()
+    queryset = OrderItem.objects.select_related('item')
+
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except CartError as e:
+            return Response({
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+    def perform_destroy(self, instance):
+        delete_line(instance)
 
 
 class PaymentAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, *args, **kwargs):
-        order = Order.objects.get(user=request.user, ordered=False)
-        userprofile = UserProfile.objects.get(user=request.user)
-
         # get data from client
         token = request.data.get('stripeToken')
         billing_address_id = request.data.get('selectedBillingAddress')
@@ -130,98 +190,21 @@ class PaymentAPIView(APIView):
         billing_address = Address.objects.get(id=billing_address_id)
         shipping_address = Address.objects.get(id=shipping_address_id)
 
-        if not userprofile.stripe_customer_id:
-            customer = stripe.Customer.create(
-                email=request.user.email,
-                source=token
-            )
-            userprofile.stripe_customer_id = customer['id']
-            userprofile.one_click_purchasing = True
-            userprofile.save()
-        else:
-            stripe.Customer.create_source(
-                userprofile.stripe_customer_id,
-                source=token
-            )
-
-        amount = int(order.get_total() * 100)  # cents
-
+        # the card is saved on the customer and charged by the payment
+        # worker, the client polls the payment for the outcome
         try:
-            # Use Stripe's library to make requests
-            charge = stripe.Charge.create(
-                amount=amount,  # cents
-                currency='usd',
-                customer=userprofile.stripe_customer_id
-            )
-
-            # create the payment
-            payment = Payment.objects.create(
-                stripe_charge_id=charge['id'],
-                user=request.user,
-                amount=order.get_total()
-            )
-
-            order.ordered = True
-            order.payment = payment
-            order.billing_address = billing_address
-            order.shipping_address = shipping_address
-            # order.ref_code = create_ref_code()
-            order.save()
-
-            order_items = order.items.all()
-            order_items.update(ordered=True)
-            for item in order_items:
-                item.save()
-
-            return Response(status=status.HTTP_200_OK)
-
-        except stripe.error.CardError as e:
-            # Since it's a decline, stripe.error.CardError will be caught
-            body = e.json_body
-            err = body.get('error', {})
-            return Response({
-                "message": err.get('message')
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        except stripe.error.RateLimitError as e:
-            # Too many requests made to the API too quickly
-            return Response({
-                "message": "Rate limit error."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        except stripe.error.InvalidRequestError as e:
-            # Invalid parameters were supplied to Stripe's API
-            return Response({
-                "message": "Invalid parameters."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        except stripe.error.AuthenticationError as e:
-            # Authentication with Stripe's API failed
-            # (maybe you changed API keys recently)
-            return Response({
-                "message": "Not authenticated."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        except stripe.error.APIConnectionError as e:
-            # Network communication with Stripe failed
-            return Response({
-                "message": "Network error."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        except stripe.error.StripeError as e:
-            return Response({
-                "message":
-                "Something went wrong. You were not charged. Plase try again."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        except Exception as e:
+            payment = submit_payment(request.user, source=token,
+                                     use_customer=True, save_source=True,
+                                     billing_address=billing_address,
+                                     shipping_address=shipping_address)
+        except PaymentError as e:
+            # hand the payment in flight back for the client to poll
             return Response({
-                "message": "A serious error occurred. We have been notified."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        return Response({
-            "message": "Invalid data received"
-        }, status=status.HTTP_400_BAD_REQUEST)
+                'message': str(e),
+                'payment': e.payment and PaymentSerializer(e.payment).data
+            }, status=status.HTTP_409_CONFLICT)
+        return Response(PaymentSerializer(payment).data,
+                        status=status.HTTP_202_ACCEPTED)
 
 
 class AddCouponAPIView(APIView):
@@ -234,10 +217,13 @@ class AddCouponAPIView(APIView):
                 'message': _('Invalid data received')
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        order = Order.objects.get(user=request.user, ordered=False)
         coupon = get_object_or_404(Coupon, code=code)
-        order.coupon = coupon
-        order.save()
+        try:
+            apply_coupon(request.user, coupon)
+        except CartError as e:
+            return Response({
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_200_OK)
 
 
@@ -280,7 +266,18 @@ class AddressDeleteAPIView(generics.DestroyAPIView):
 
 class CountryListAPIView(APIView):
     def get(self, request, *args, **kwargs):
-        return Response(countries, status=status.HTTP_200_OK)
+        # rendered once per process and language
+        content, etag = rendered_countries()
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+
+        response['ETag'] = etag
+        patch_cache_control(response, public=True,
+                            max_age=settings.COUNTRY_LIST_MAX_AGE)
+        patch_vary_headers(response, ['Accept-Language'])
+        return response
 
 
 class OrderItemQuantityUpdateAPIView(APIView):
@@ -292,38 +289,15 @@ class OrderItemQuantityUpdateAPIView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         item = get_object_or_404(Item, slug=slug)
-        order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-        # item exists in the cart
-        if order_qs.exists():
-            order = order_qs.first()
-
-            # check if the order item is in the order
-            if order.items.filter(item__slug=item.slug).exists():
-                order_item = OrderItem.objects.filter(item=item,
-                    user=request.user, ordered=False).first()
-
-                # if order_item.quantity == 1:
-                #     order.items.remove(order_item)
-                #     return Response({
-                #         'message': _('This item was removed from your cart')
-                #     }, status=status.HTTP_200_OK)
-
-                if order_item.quantity > 1:
-                    order_item.quantity -= 1
-                    order_item.save()
-                else:
-                    order.items.remove(order_item)
-                # cart updated successfully
-                return Response(status=status.HTTP_200_OK)
-            else:
-                return Response({
-                    'message': _('This item was not in your cart')
-                }, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({
-            'message': _('You don not have an active order')
-        }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            remove_from_cart(request.user, item, single=True)
+        except CartError as e:
+            return Response({
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # cart updated successfully
+        return Response(status=status.HTTP_200_OK)
 
 
 class PaymentListAPIView(generics.ListAPIView):
@@ -331,5 +305,14 @@ class PaymentListAPIView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Payment.objects.filter(user=self.request.user
+        return Payment.objects.filter(user=self.request.user,
+                                      status=Payment.SUCCEEDED
                                         ).order_by('-timestamp')
+
+
+class PaymentDetailAPIView(generics.RetrieveAPIView):
+    serializer_class = PaymentSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Payment.objects.filter(user=self.request.user)
@@ -1,5 +1,24 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import catalog_cache, images, search
+        from .models import Item, Variation, ItemVariation
+
+        post_save.connect(search.update_search_index, sender=Item)
+        post_delete.connect(search.remove_from_search_index, sender=Item)
+
+        # catalog cache invalidation
+        for signal in (post_save, post_delete):
+            signal.connect(catalog_cache.item_changed, sender=Item)
+            signal.connect(catalog_cache.variation_changed, sender=Variation)
+            signal.connect(catalog_cache.item_variation_changed,
+                           sender=ItemVariation)
+
+        # resized copies of the uploaded images
+        post_save.connect(images.schedule_renditions, sender=Item)
+        post_save.connect(images.schedule_renditions, sender=ItemVariation)
@@ -0,0 +1,322 @@
+import json
+import os
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    Address,
+    Coupon,
+    Item,
+    ItemVariation,
+    Order,
+    OrderItem,
+    Payment,
+    UserProfile,
+    Variation,
+)
+from .search import inverted_index, item_search_vector, uses_postgres
+
+
+User = get_user_model()
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__),
+                             'benchmark_baseline.json')
+
+DEFAULT_SCALE = {
+    'users': 20,
+    'items': 100,
+    'variations': 2,  # per item
+    'values': 3,  # per variation
+    'cart_lines': 3,  # per user
+    'orders': 2,  # completed orders per user
+}
+
+# wall time and memory vary from run to run, a result only regresses when
+# it's off by more than the tolerance and the slack
+TIME_SLACK_MS = 2.0
+MEMORY_SLACK_KB = 64.0
+
+
+def create_all(model, objects, batch_size=500):
+    """bulk_create that also sets the pks, which sqlite doesn't return."""
+    last_pk = model.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    model.objects.bulk_create(objects, batch_size=batch_size)
+
+    pks = model.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+        'pk', flat=True)
+    for obj, pk in zip(objects, pks):
+        obj.pk = pk
+    return objects
+
+
+def seed(users, items, variations, values, cart_lines, orders):
+    """Create a synthetic catalog and user base.
+
+    Every user has a billing and a shipping address, an open cart of
+    `cart_lines` lines and `orders` paid orders of as many lines. Returns
+    the objects the endpoints are benchmarked with, all belonging to the
+    first user, who is staff.
+    """
+    now = timezone.now()
+
+    catalog = create_all(Item, [
+        Item(title=f'Item {i}', price=10 + i % 50,
+             discount_price=5 + i % 5 if i % 3 == 0 else None,
+             category=('S', 'SW', 'OW')[i % 3], label=('P', 'S', 'D')[i % 3],
+             slug=f'item-{i}', description=f'Description of item {i}',
+             image='item.jpg')
+        for i in range(items)
+    ])
+    item_variations = create_all(Variation, [
+        Variation(item=item, name=f'variation {i}')
+        for item in catalog for i in range(variations)
+    ])
+    item_variation_values = create_all(ItemVariation, [
+        ItemVariation(variation=variation, value=f'value {i}')
+        for variation in item_variations for i in range(values)
+    ])
+
+    # the first value of every variation, per item
+    picked = {item.pk: [] for item in catalog}
+    for item_variation in item_variation_values[::values or 1]:
+        picked[item_variation.variation.item_id].append(item_variation.pk)
+
+    accounts = create_all(User, [
+        User(username=f'bench{i}', is_staff=i == 0) for i in range(users)
+    ])
+    UserProfile.objects.bulk_create(
+        [UserProfile(user=user) for user in accounts])
+    Address.objects.bulk_create([
+        Address(user=user, street_address='1 Main Street',
+                apartment_address='Apt 1', country='US', zip='10001',
+                address_type=address_type, default=True)
+        for user in accounts for address_type in ('B', 'S')
+    ])
+    coupon = Coupon.objects.create(code='BENCH', amount=5)
+
+    payments = create_all(Payment, [
+        Payment(user=user, amount=0, stripe_charge_id=f'ch_bench{i}',
+                status=Payment.SUCCEEDED, processed_at=now)
+        for i, user in enumerate(
+            user for user in accounts for _ in range(orders))
+    ])
+    carts = create_all(Order, [
+        Order(user=user, ordered_date=now) for user in accounts
+    ])
+    paid = create_all(Order, [
+        Order(user=payment.user, ordered_date=now, ordered=True,
+              payment=payment, ref_code=f'bench{payment.pk}')
+        for payment in payments
+    ])
+
+    lines = []
+    for n, order in enumerate(carts + paid):
+        for i in range(cart_lines):
+            item = catalog[(n * cart_lines + i) % len(catalog)]
+            lines.append((order, OrderItem(
+                user=order.user, item=item, quantity=1 + i % 2,
+                ordered=order.ordered,
+                variation_signature=OrderItem.make_variation_signature(
+                    picked[item.pk]))))
+    create_all(OrderItem, [order_item for _, order_item in lines])
+
+    OrderItem.item_variations.through.objects.bulk_create([
+        OrderItem.item_variations.through(orderitem=order_item,
+                                          itemvariation_id=pk)
+        for _, order_item in lines for pk in picked[order_item.item_id]
+    ], batch_size=500)
+    Order.items.through.objects.bulk_create([
+        Order.items.through(order=order, orderitem=order_item)
+        for order, order_item in lines
+    ], batch_size=500)
+    Order.objects.refresh_summaries()
+
+    # bulk_create skips the signals maintaining the search index
+    if uses_postgres():
+        Item.objects.update(search_vector=item_search_vector())
+    else:
+        inverted_index.reset()
+
+    user = accounts[0]
+    return SimpleNamespace(
+        user=user,
+        item=catalog[-1],
+        item_variations=picked[catalog[-1].pk],
+        cart_item=lines[0][1],
+        address=Address.objects.filter(user=user, address_type='S').first(),
+        coupon=coupon,
+        payment=payments[0] if payments else None,
+    )
+
+
+class Endpoint:
+    """A request to one of the URLs in core.api.urls.
+
+    `kwargs` and `data` are functions of the seeded objects.
+    """
+
+    def __init__(self, name, method='get', kwargs=None, data=None,
+                 query=None):
+        self.name = name
+        self.method = method
+        self.kwargs = kwargs or (lambda fixture: {})
+        self.data = data or (lambda fixture: None)
+        self.query = query or ''
+
+    def request(self, client, fixture):
+        url = reverse(self.name, kwargs=self.kwargs(fixture)) + self.query
+        return getattr(client, self.method)(url, self.data(fixture),
+                                            format='json')
+
+
+def address_data(fixture):
+    return {
+        'street_address': '2 Main Street',
+        'apartment_address': 'Apt 2',
+        'country': 'US',
+        'zip': '10002',
+        'address_type': 'S',
+        'default': False,
+    }
+
+
+ENDPOINTS = [
+    Endpoint('product_list'),
+    Endpoint('product_detail', kwargs=lambda f: {'pk': f.item.pk}),
+    Endpoint('catalog_cache_stats'),
+    Endpoint('sql_profile_stats'),
+    Endpoint('add_to_cart', 'post', data=lambda f: {
+        'slug': f.item.slug, 'variations': f.item_variations}),
+    Endpoint('order_summary'),
+    Endpoint('checkout', 'post', data=lambda f: {
+        'stripeToken': 'tok_visa',
+        'selectedBillingAddress': f.address.pk,
+        'selectedShippingAddress': f.address.pk,
+    }),
+    Endpoint('add_coupon', 'post', data=lambda f: {'code': f.coupon.code}),
+    Endpoint('address_list', query='?address-type=S'),
+    Endpoint('address_create', 'post', data=address_data),
+    Endpoint('address_update', 'put', kwargs=lambda f: {'pk': f.address.pk},
+             data=address_data),
+    Endpoint('address_delete', 'delete',
+             kwargs=lambda f: {'pk': f.address.pk}),
+    Endpoint('country_list'),
+    Endpoint('orderitem_delete', 'delete',
+             kwargs=lambda f: {'pk': f.cart_item.pk}),
+    Endpoint('orderitem_update_quantity', 'post',
+             data=lambda f: {'slug': f.cart_item.item.slug}),
+    Endpoint('payment_list'),
+    Endpoint('payment_detail', kwargs=lambda f: {'pk': f.payment.pk}),
+]
+
+
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def run_request(client, endpoint, fixture):
+    """Send the request against empty caches and undo what it changed.
+
+    Returns the response and the queries it ran.
+    """
+    with transaction.atomic():
+        clear_caches()
+        with CaptureQueriesContext(connection) as queries:
+            response = endpoint.request(client, fixture)
+        transaction.set_rollback(True)
+    return response, len(queries)
+
+
+def measure(client, endpoint, fixture, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response, queries = run_request(client, endpoint, fixture)
+        times.append((time.perf_counter() - start) * 1000)
+
+    # tracing slows everything down, memory is measured on its own run
+    tracemalloc.start()
+    try:
+        run_request(client, endpoint, fixture)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': queries,
+        # the fastest run is the least disturbed by the rest of the machine
+        'time_ms': round(min(times), 3),
+        'memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(fixture, repeat=5, endpoints=ENDPOINTS):
+    """Measure every endpoint as the seeded user, returns {name: result}."""
+    client = APIClient()
+    client.force_authenticate(fixture.user)
+    return {endpoint.name: measure(client, endpoint, fixture, repeat)
+            for endpoint in endpoints}
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(results, scale, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump({'scale': scale, 'endpoints': results}, f, indent=2,
+                  sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.25):
+    """List how the results regressed from the baseline.
+
+    Returns the regressions and the warnings. Query counts and statuses
+    are deterministic and must match or improve exactly. Time and memory
+    depend on the machine and its load, running over the tolerances,
+    fractions of the baseline values, is only a warning.
+    """
+    regressions, warnings = [], []
+    for name, result in results.items():
+        expected = baseline['endpoints'].get(name)
+        if expected is None:
+            continue
+
+        if result['status'] != expected['status']:
+            regressions.append(
+                f"{name}: status {result['status']}, "
+                f"baseline {expected['status']}")
+        if result['queries'] > expected['queries']:
+            regressions.append(
+                f"{name}: {result['queries']} queries, "
+                f"baseline {expected['queries']}")
+        if (result['time_ms'] > expected['time_ms'] * (1 + time_tolerance) +
+                TIME_SLACK_MS):
+            warnings.append(
+                f"{name}: {result['time_ms']:.1f} ms, "
+                f"baseline {expected['time_ms']:.1f} ms")
+        if (result['memory_kb'] >
+                expected['memory_kb'] * (1 + memory_tolerance) +
+                MEMORY_SLACK_KB):
+            warnings.append(
+                f"{name}: {result['memory_kb']:.0f} KB, "
+                f"baseline {expected['memory_kb']:.0f} KB")
+    return regressions, warnings
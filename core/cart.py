@@ -0,0 +1,170 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import Order, OrderItem, ItemVariation
+
+
+class CartError(Exception):
+    pass
+
+
+def get_cart_item_count(user):
+    """Number of lines in the user's open order.
+
+    The count is cached per user until the next cart change and memoized
+    on the user object, so a page asks for it at most once.
+    """
+    if not user.is_authenticated:
+        return 0
+
+    if not hasattr(user, '_cart_item_count'):
+        key = Order.cart_cache_key(user.pk)
+        count = cache.get(key)
+        if count is None:
+            count = Order.objects.filter(
+                user=user, ordered=False
+            ).values_list('item_count', flat=True).first() or 0
+            cache.set(key, count, settings.CART_CACHE_TIMEOUT)
+        user._cart_item_count = count
+    return user._cart_item_count
+
+
+def clean_variations(item, item_variation_ids, required=True):
+    """Check that one value was picked for every variation of the item.
+
+    Returns the ItemVariation ids, raises CartError otherwise. Without
+    `required` no value at all is accepted too.
+    """
+    try:
+        requested = {int(pk) for pk in item_variation_ids}
+    except (TypeError, ValueError):
+        raise CartError(_('Invalid request'))
+    if not requested and not required:
+        return []
+
+    values = dict(ItemVariation.objects.filter(
+        variation__item=item).values_list('pk', 'variation_id'))
+
+    picked = [values[pk] for pk in requested if pk in values]
+    if (len(picked) != len(requested) or
+            len(set(picked)) != len(picked) or
+            set(picked) != set(values.values())):
+        raise CartError(_('Please specify the required variations'))
+    return sorted(requested)
+
+
+def lock_cart(**lookups):
+    """The open order matching `lookups`, locked until the end of the
+    transaction.
+
+    Raises CartError while its checkout payment is pending: the order has
+    to keep the amount the payment will charge.
+    """
+    order = Order.objects.select_for_update(of=('self',)).select_related(
+        'payment').filter(ordered=False, **lookups).first()
+    if order is not None and order.payment_pending:
+        raise CartError(_('Your order is being paid and can not change'))
+    return order
+
+
+def add_to_cart(user, item, item_variation_ids=(), require_variations=True):
+    """Add one unit of `item` in the given variations to the user's cart.
+
+    Lines are matched by their variation signature, an existing one is
+    incremented with an F() expression while the open order is locked, so
+    concurrent adds neither lose increments nor create duplicate lines.
+    Returns True when a new line was created.
+    """
+    item_variation_ids = clean_variations(item, item_variation_ids,
+                                          required=require_variations)
+    signature = OrderItem.make_variation_signature(item_variation_ids)
+
+    with transaction.atomic():
+        order = lock_cart(user=user)
+        if order is None:
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(user=user,
+                                                 ordered_date=timezone.now())
+            except IntegrityError:
+                # a concurrent request opened the cart first
+                order = lock_cart(user=user)
+
+        # a single probe of the cart line index, limited to the lines of
+        # the open order as a line taken out of it stays open
+        updated = OrderItem.objects.filter(
+            user=user, ordered=False, item=item,
+            variation_signature=signature, order=order
+        ).update(quantity=F('quantity') + 1)
+
+        if updated:
+            order.update_summary(item, quantity=1)
+            return False
+
+        order_item = OrderItem.objects.create(
+            user=user, item=item, variation_signature=signature)
+        OrderItem.item_variations.through.objects.bulk_create([
+            OrderItem.item_variations.through(
+                orderitem=order_item, itemvariation_id=pk)
+            for pk in item_variation_ids
+        ])
+        Order.items.through.objects.create(order=order,
+                                           orderitem=order_item)
+        order.update_summary(item, quantity=1, lines=1)
+        return True
+
+
+def remove_from_cart(user, item, single=False):
+    """Take `item` out of the user's cart, or one unit of it when `single`.
+
+    The open order is locked while the line and the summary change, the
+    quantity is decremented with an F() expression. Returns True when the
+    line was deleted, raises CartError without an open order or line.
+    """
+    with transaction.atomic():
+        order = lock_cart(user=user)
+        if order is None:
+            raise CartError(_('You do not have an active order'))
+
+        order_item = order.items.filter(item=item).first()
+        if order_item is None:
+            raise CartError(_('This item was not in your cart'))
+
+        if single and OrderItem.objects.filter(
+                pk=order_item.pk, quantity__gt=1
+        ).update(quantity=F('quantity') - 1):
+            order.update_summary(item, quantity=-1)
+            return False
+
+        # deleting the line also takes it out of the order
+        order_item.delete()
+        order.update_summary(item, quantity=-order_item.quantity, lines=-1)
+        return True
+
+
+def delete_line(order_item):
+    """Delete a cart line, taking it out of its open order's summary."""
+    with transaction.atomic():
+        order = lock_cart(items=order_item)
+        # read again now that the order is locked
+        quantity = OrderItem.objects.filter(pk=order_item.pk).values_list(
+            'quantity', flat=True).first()
+        if quantity is None:
+            return
+
+        order_item.delete()
+        if order is not None:
+            order.update_summary(order_item.item, quantity=-quantity,
+                                 lines=-1)
+
+
+def apply_coupon(user, coupon):
+    with transaction.atomic():
+        order = lock_cart(user=user)
+        if order is None:
+            raise CartError(_('You do not have an active order'))
+        order.apply_coupon(coupon)
@@ -0,0 +1,119 @@
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import CATALOG_CACHE_LOOKUPS
+from .models import Variation
+
+
+LIST_VERSION_KEY = 'catalog:list-version'
+ITEM_VERSION_KEY = 'catalog:item-version:{}'
+
+# hits and misses of this process, counting them in the cache would cost a
+# write per lookup. The catalog_cache_lookups_total metric adds up the
+# processes
+lookups = Counter()
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def new_version():
+    # seeded from the clock so a version lost to eviction never brings
+    # back keys cached under an older one
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), None)
+
+
+def list_version():
+    return get_version(LIST_VERSION_KEY)
+
+
+def item_version(pk):
+    return get_version(ITEM_VERSION_KEY.format(pk))
+
+
+def _digest(value):
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def list_key(variant):
+    """Key for a page of the catalog, `variant` tells pages apart."""
+    return f'catalog:list:{list_version()}:{_digest(variant)}'
+
+
+def item_key(pk, variant):
+    """Key for a single item, versioned on its own changes."""
+    return f'catalog:item:{pk}:{item_version(pk)}:{_digest(variant)}'
+
+
+def get_or_set(key, build):
+    """Return the cached value for `key`, building and storing it on a miss."""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        lookups['miss'] += 1
+        CATALOG_CACHE_LOOKUPS.labels('miss').inc()
+        value = build()
+        cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT)
+    else:
+        lookups['hit'] += 1
+        CATALOG_CACHE_LOOKUPS.labels('hit').inc()
+    return value
+
+
+def stats():
+    """Hit ratio of the lookups made by this process."""
+    hits, misses = lookups['hit'], lookups['miss']
+    total = hits + misses
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else None,
+    }
+
+
+def item_changed(sender, instance, **kwargs):
+    bump_version(ITEM_VERSION_KEY.format(instance.pk))
+    bump_version(LIST_VERSION_KEY)
+
+
+def items_changed(pks):
+    """Invalidate the catalog after items were written without signals."""
+    for pk in pks:
+        bump_version(ITEM_VERSION_KEY.format(pk))
+    bump_version(LIST_VERSION_KEY)
+
+
+def variation_changed(sender, instance, **kwargs):
+    bump_version(ITEM_VERSION_KEY.format(instance.item_id))
+
+
+def item_variation_changed(sender, instance, **kwargs):
+    # the variation is already gone when this runs for a cascade delete,
+    # its own receiver takes care of the item then
+    item_id = Variation.objects.filter(
+        pk=instance.variation_id).values_list('item_id', flat=True).first()
+    if item_id is not None:
+        bump_version(ITEM_VERSION_KEY.format(item_id))
@@ -0,0 +1,231 @@
+import csv
+import itertools
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from . import catalog_cache, search
+from .models import (
+    CATEGORY_CHOICES,
+    LABEL_CHOICES,
+    Item,
+    ItemVariation,
+    Order,
+    Variation,
+)
+
+
+ITEM_FIELDS = ('title', 'price', 'discount_price', 'category', 'label',
+               'description', 'image')
+
+
+class FeedError(ValueError):
+    pass
+
+
+def read_jsonl(f):
+    """Records of a JSON lines feed, one item per line.
+
+    {"slug": ..., "title": ..., "price": ..., "image": ..., "values": [
+        {"variation": "size", "value": "L", "attachment": ""}, ...]}
+    """
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield {'error': f'line {number}: {e}'}
+
+
+def read_csv(f):
+    """Records of a CSV feed, one row per variation value.
+
+    The rows of an item follow each other and repeat its columns, an item
+    without variations is a row with empty variation and value columns.
+    """
+    rows = csv.DictReader(f)
+    for _, group in itertools.groupby(rows, key=lambda row: row.get('slug')):
+        group = list(group)
+        record = dict(group[0])
+        record['values'] = [row for row in group if row.get('variation')]
+        yield record
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def parse_price(slug, value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise FeedError(f'{slug}: invalid {field} {value!r}')
+
+
+def parse_record(data):
+    """(slug, item fields, [(variation, value, attachment)])"""
+    if data.get('error'):
+        raise FeedError(data['error'])
+    slug = (data.get('slug') or '').strip()
+    if not slug:
+        raise FeedError('missing slug')
+
+    fields = {field: data.get(field) or '' for field in ITEM_FIELDS}
+    if not fields['title']:
+        raise FeedError(f'{slug}: missing title')
+    fields['price'] = parse_price(slug, data.get('price'), 'price')
+    if fields['price'] is None:
+        raise FeedError(f'{slug}: missing price')
+    fields['discount_price'] = parse_price(
+        slug, data.get('discount_price'), 'discount_price')
+    for field, choices in (('category', CATEGORY_CHOICES),
+                           ('label', LABEL_CHOICES)):
+        if fields[field] not in dict(choices):
+            raise FeedError(f'{slug}: invalid {field} {fields[field]!r}')
+
+    values = []
+    for value in data.get('values') or ():
+        if not value.get('variation') or not value.get('value'):
+            raise FeedError(f'{slug}: variation values need a variation '
+                            f'and a value')
+        values.append((value['variation'], value['value'],
+                       value.get('attachment') or ''))
+    return slug, fields, values
+
+
+def upsert_items(records, counts):
+    """Create or update the items.
+
+    Returns {slug: pk} and the primary keys of the created and the updated
+    items.
+    """
+    existing = {}
+    for item in Item.objects.filter(slug__in=records).only(
+            'pk', 'slug', *ITEM_FIELDS).order_by('pk'):
+        # slugs aren't unique, the oldest item gets the update
+        existing.setdefault(item.slug, item)
+
+    new = [Item(slug=slug, **fields)
+           for slug, (fields, _) in records.items() if slug not in existing]
+    Item.objects.bulk_create(new)
+    counts['created'] += len(new)
+
+    changed = []
+    for slug, item in existing.items():
+        fields, _ = records[slug]
+        if all(getattr(item, field) == value
+               for field, value in fields.items()):
+            continue
+        for field, value in fields.items():
+            setattr(item, field, value)
+        changed.append(item)
+    Item.objects.bulk_update(changed, ITEM_FIELDS)
+    counts['updated'] += len(changed)
+    counts['unchanged'] += len(existing) - len(changed)
+
+    # bulk_create only sets the primary keys on postgres
+    created = dict(Item.objects.filter(
+        slug__in=[item.slug for item in new]).values_list('slug', 'pk'))
+    item_ids = {slug: item.pk for slug, item in existing.items()}
+    item_ids.update(created)
+    return item_ids, set(created.values()), {item.pk for item in changed}
+
+
+def upsert_variations(records, item_ids, counts):
+    """Create the missing variations and values, returns the changed items."""
+    wanted = {(item_ids[slug], name)
+              for slug, (_, values) in records.items()
+              for name, _, _ in values}
+    variations = Variation.objects.filter(item__in=item_ids.values())
+    variation_ids = {(item_id, name): pk for pk, item_id, name in
+                     variations.values_list('pk', 'item_id', 'name')}
+    missing = wanted - variation_ids.keys()
+    if missing:
+        Variation.objects.bulk_create([Variation(item_id=item_id, name=name)
+                                       for item_id, name in missing])
+        variation_ids = {(item_id, name): pk for pk, item_id, name in
+                         variations.values_list('pk', 'item_id', 'name')}
+        counts['variations_created'] += len(missing)
+
+    item_variations = {
+        (item_variation.variation_id, item_variation.value): item_variation
+        for item_variation in ItemVariation.objects.filter(
+            variation__item__in=item_ids.values()).only(
+                'pk', 'variation_id', 'value', 'attachment')
+    }
+    new, changed, changed_items = {}, [], {item_id for item_id, _ in missing}
+    for slug, (_, values) in records.items():
+        item_id = item_ids[slug]
+        for name, value, attachment in values:
+            variation_id = variation_ids[item_id, name]
+            item_variation = item_variations.get((variation_id, value))
+            if item_variation is None:
+                new[variation_id, value] = ItemVariation(
+                    variation_id=variation_id, value=value,
+                    attachment=attachment)
+            elif (item_variation.attachment.name or '') != attachment:
+                item_variation.attachment = attachment
+                changed.append(item_variation)
+            else:
+                continue
+            changed_items.add(item_id)
+
+    ItemVariation.objects.bulk_create(new.values())
+    ItemVariation.objects.bulk_update(changed, ['attachment'])
+    counts['values_created'] += len(new)
+    counts['values_updated'] += len(changed)
+    return changed_items
+
+
+@transaction.atomic
+def write_batch(records, counts):
+    """Upsert {slug: (item fields, values)}.
+
+    Returns the primary keys of the created items and of the existing
+    ones that changed.
+    """
+    item_ids, created, updated = upsert_items(records, counts)
+    changed = updated | upsert_variations(records, item_ids, counts)
+
+    # the bulk queries skip the Item signals
+    search.reindex_items(created | updated)
+    if updated:
+        Order.objects.filter(
+            ordered=False, items__item__in=updated).refresh_summaries()
+    return created, changed - created
+
+
+def import_catalog(records, batch_size=None):
+    """Upsert the items of a feed by slug, batch_size at a time.
+
+    Variations and values missing are added, the ones absent from the
+    feed are kept. Yields the counts and the errors of each batch once
+    it's committed.
+    """
+    batch_size = batch_size or settings.CATALOG_IMPORT_BATCH_SIZE
+    records = iter(records)
+    while True:
+        counts, errors, batch = Counter(), [], {}
+        for data in itertools.islice(records, batch_size):
+            try:
+                slug, fields, values = parse_record(data)
+            except FeedError as e:
+                errors.append(str(e))
+                counts['failed'] += 1
+                continue
+            batch[slug] = (fields, values)
+        if not batch and not errors:
+            return
+
+        if batch:
+            created, changed = write_batch(batch, counts)
+            if created or changed:
+                catalog_cache.items_changed(changed)
+        yield counts, errors
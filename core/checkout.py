@@ -0,0 +1,32 @@
+import random
+import string
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Order, OrderItem
+
+
+def create_ref_code():
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=24))
+
+
+def finalize_order(payment):
+    """Mark the open order paid by payment and all its lines ordered.
+
+    Two UPDATEs in one transaction however many lines the order has.
+    Returns whether an order was finalized.
+    """
+    with transaction.atomic():
+        finalized = Order.objects.filter(
+            payment=payment, ordered=False
+        ).update(ordered=True, ref_code=create_ref_code())
+        if finalized:
+            OrderItem.objects.filter(order__payment=payment).update(
+                ordered=True)
+
+    if finalized:
+        # the cart badge, the order belongs to the payer
+        key = Order.cart_cache_key(payment.user_id)
+        transaction.on_commit(lambda: cache.delete(key))
+    return bool(finalized)
@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_item_count
+
+
+def cart(request):
+    # only computed when a template actually renders the badge
+    return {
+        'cart_item_count': SimpleLazyObject(
+            lambda: get_cart_item_count(request.user)),
+    }
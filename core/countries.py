@@ -0,0 +1,34 @@
+import hashlib
+import json
+from functools import lru_cache
+
+from django.utils.translation import get_language
+from django_countries import countries
+
+
+@lru_cache(maxsize=None)
+def _country_choices(language):
+    return tuple((code, str(name)) for code, name in countries)
+
+
+def country_choices():
+    """((code, name), ...) sorted by name, in the active language.
+
+    Built once per process and language, the list only changes with a
+    deploy.
+    """
+    return _country_choices(get_language())
+
+
+@lru_cache(maxsize=None)
+def _rendered_countries(language):
+    # compact and unescaped, as DRF's JSONRenderer writes it
+    content = json.dumps(dict(_country_choices(language)),
+                         ensure_ascii=False, separators=(',', ':')).encode()
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+    return content, etag
+
+
+def rendered_countries():
+    """The {code: name} JSON of the country list endpoint and its ETag."""
+    return _rendered_countries(get_language())
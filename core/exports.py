@@ -0,0 +1,167 @@
+import csv
+import json
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+
+from .models import Order, cart_prefetch
+
+
+CSV_COLUMNS = (
+    'id', 'ref_code', 'user', 'start_date', 'ordered_date', 'ordered',
+    'being_delivered', 'received', 'refund_requested', 'refund_granted',
+    'shipping_address', 'billing_address', 'coupon', 'item_count',
+    'subtotal', 'discount', 'total', 'payment_status', 'payment_amount',
+    'stripe_charge_id', 'lines',
+)
+
+
+def export_queryset(queryset=None):
+    if queryset is None:
+        queryset = Order.objects.all()
+    return queryset.select_related(
+        'user', 'shipping_address', 'billing_address', 'payment', 'coupon'
+    ).order_by('pk')
+
+
+def iter_orders(queryset, chunk_size=None):
+    """Orders with their lines, read chunk_size at a time.
+
+    iterator() streams from a server-side cursor but skips prefetches, so
+    the lines are loaded once per chunk instead.
+    """
+    chunk_size = chunk_size or settings.ORDER_EXPORT_CHUNK_SIZE
+    chunk = []
+    for order in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) == chunk_size:
+            prefetch_related_objects(chunk, cart_prefetch())
+            yield from chunk
+            chunk = []
+    if chunk:
+        prefetch_related_objects(chunk, cart_prefetch())
+        yield from chunk
+
+
+def format_date(value):
+    return value.isoformat() if value else None
+
+
+def address_record(address):
+    if address is None:
+        return None
+    return {
+        'street_address': address.street_address,
+        'apartment_address': address.apartment_address,
+        'zip': address.zip,
+        'country': address.country.code,
+    }
+
+
+def payment_record(payment):
+    if payment is None:
+        return None
+    return {
+        'id': payment.pk,
+        'status': payment.status,
+        'amount': payment.amount,
+        'stripe_charge_id': payment.stripe_charge_id,
+        'timestamp': format_date(payment.timestamp),
+    }
+
+
+def line_record(order_item):
+    return {
+        'item': order_item.item.slug,
+        'title': order_item.item.title,
+        'quantity': order_item.quantity,
+        'final_price': order_item.get_final_price(),
+        'variations': {
+            item_variation.variation.name: item_variation.value
+            for item_variation in order_item.item_variations.all()
+        },
+    }
+
+
+def order_record(order):
+    return {
+        'id': order.pk,
+        'ref_code': order.ref_code,
+        'user': order.user.username,
+        'start_date': format_date(order.start_date),
+        'ordered_date': format_date(order.ordered_date),
+        'ordered': order.ordered,
+        'being_delivered': order.being_delivered,
+        'received': order.received,
+        'refund_requested': order.refund_requested,
+        'refund_granted': order.refund_granted,
+        'shipping_address': address_record(order.shipping_address),
+        'billing_address': address_record(order.billing_address),
+        'coupon': order.coupon.code if order.coupon else None,
+        'item_count': order.item_count,
+        'subtotal': order.subtotal,
+        'discount': order.discount,
+        'total': order.total,
+        'payment': payment_record(order.payment),
+        'lines': [line_record(order_item)
+                  for order_item in order.items.all()],
+    }
+
+
+def format_address(address):
+    if address is None:
+        return ''
+    return ', '.join(filter(None, (
+        address['street_address'], address['apartment_address'],
+        address['zip'], address['country'])))
+
+
+def format_line(line):
+    variations = ', '.join(f'{name}: {value}'
+                           for name, value in line['variations'].items())
+    text = f"{line['quantity']} x {line['item']}"
+    return f'{text} ({variations})' if variations else text
+
+
+def csv_row(record):
+    payment = record['payment'] or {}
+    row = dict(record,
+               shipping_address=format_address(record['shipping_address']),
+               billing_address=format_address(record['billing_address']),
+               payment_status=payment.get('status'),
+               payment_amount=payment.get('amount'),
+               stripe_charge_id=payment.get('stripe_charge_id'),
+               lines='; '.join(map(format_line, record['lines'])))
+    return [row[column] for column in CSV_COLUMNS]
+
+
+class Echo:
+    """File-like object handing back what csv.writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(orders):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order in orders:
+        yield writer.writerow(csv_row(order_record(order)))
+
+
+def export_jsonl(orders):
+    for order in orders:
+        yield json.dumps(order_record(order)) + '\n'
+
+
+# format: (generator of text chunks, content type)
+FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'jsonl': (export_jsonl, 'application/x-ndjson'),
+}
+
+
+def export_orders(queryset=None, export_format='csv', chunk_size=None):
+    """Yield the orders as CSV or JSONL text, one order at a time."""
+    export, _ = FORMATS[export_format]
+    return export(iter_orders(export_queryset(queryset), chunk_size))
@@ -1,7 +1,8 @@
 from django import forms
-from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
 
+from .countries import country_choices
+
 
 PAYMENT_CHOICES = (
     ('S', 'Stripe'),
@@ -9,13 +10,18 @@ PAYMENT_CHOICES = (
 )
 
 
+def country_form_choices():
+    # evaluated by each form, from the list cached per language
+    return (('', '(select country)'),) + country_choices()
+
 
 class CheckoutForm(forms.Form):
     shipping_address = forms.CharField(required=False)
     shipping_address2 = forms.CharField(required=False)
 
-    shipping_country = CountryField(blank_label='(select country)').formfield(
+    shipping_country = forms.ChoiceField(
         required=False,
+        choices=country_form_choices,
         widget=CountrySelectWidget(attrs={
             'class': 'custom-select d-block w-100',
     }))
@@ -25,8 +31,9 @@ class CheckoutForm(forms.Form):
     billing_address = forms.CharField(required=False)
     billing_address2 = forms.CharField(required=False)
     
-    billing_country = CountryField(blank_label='(select country)').formfield(
+    billing_country = forms.ChoiceField(
         required=False,
+        choices=country_form_choices,
         widget=CountrySelectWidget(attrs={
             'class': 'custom-select d-block w-100',
     }))
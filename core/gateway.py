@@ -0,0 +1,136 @@
+import itertools
+
+import stripe
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import gateway_call
+
+
+class StripeGateway:
+    """Talks to Stripe, the gateway used in production."""
+
+    def __init__(self):
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+
+    @gateway_call('create_customer')
+    def create_customer(self, email, source):
+        customer = stripe.Customer.create(email=email, source=source)
+        return customer['id']
+
+    @gateway_call('add_source')
+    def add_source(self, customer_id, source):
+        """Save a card token on the customer, returns the card id."""
+        card = stripe.Customer.create_source(customer_id, source=source)
+        return card['id']
+
+    @gateway_call('charge')
+    def charge(self, amount, customer_id=None, source=None,
+               idempotency_key=None):
+        """Charge `amount` cents to a card token, or to a saved customer's
+        card, `source` or else its default one.
+
+        A charge retried with the same idempotency_key returns the first
+        one instead of charging again.
+        """
+        if customer_id:
+            charge = stripe.Charge.create(amount=amount, currency='usd',
+                                          customer=customer_id,
+                                          source=source or None,
+                                          idempotency_key=idempotency_key)
+        else:
+            charge = stripe.Charge.create(amount=amount, currency='usd',
+                                          source=source,
+                                          idempotency_key=idempotency_key)
+        return charge['id']
+
+    @gateway_call('list_cards')
+    def list_cards(self, customer_id, limit=3):
+        cards = stripe.Customer.list_sources(customer_id, limit=limit,
+                                             object='card')
+        return cards['data']
+
+
+class FakeGateway:
+    """In-memory gateway for tests and local development.
+
+    Any token is accepted except `tok_chargeDeclined`, which is declined
+    like the Stripe test token of the same name. As on Stripe a customer's
+    first card stays its default one. Every call is recorded in `calls`.
+    """
+
+    DECLINED_TOKEN = 'tok_chargeDeclined'
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.calls = []
+        # customer id: cards, newest first
+        self.cards = {}
+        self.default_cards = {}
+        self.declined_cards = set()
+        # idempotency key: charge id
+        self.charges = {}
+
+    def create_customer(self, email, source):
+        self.calls.append(('create_customer', email, source))
+        customer_id = f'cus_fake{next(self.ids)}'
+        self.cards[customer_id] = []
+        self.default_cards[customer_id] = self._add_card(customer_id, source)
+        return customer_id
+
+    def add_source(self, customer_id, source):
+        self.calls.append(('add_source', customer_id, source))
+        return self._add_card(customer_id, source)
+
+    def charge(self, amount, customer_id=None, source=None,
+               idempotency_key=None):
+        self.calls.append(('charge', amount, customer_id, source))
+        if idempotency_key in self.charges:
+            return self.charges[idempotency_key]
+        if customer_id:
+            card_id = source or self.default_cards[customer_id]
+            declined = card_id in self.declined_cards
+        else:
+            declined = source == self.DECLINED_TOKEN
+        if declined:
+            message = 'Your card was declined.'
+            raise stripe.error.CardError(
+                message, None, 'card_declined',
+                json_body={'error': {'message': message}})
+        charge_id = f'ch_fake{next(self.ids)}'
+        if idempotency_key:
+            self.charges[idempotency_key] = charge_id
+        return charge_id
+
+    def list_cards(self, customer_id, limit=3):
+        self.calls.append(('list_cards', customer_id))
+        return self.cards.get(customer_id, [])[:limit]
+
+    def _add_card(self, customer_id, source):
+        card_id = f'card_fake{next(self.ids)}'
+        self.cards.setdefault(customer_id, []).insert(0, {
+            'id': card_id,
+            'brand': 'Visa',
+            'last4': '0002' if source == self.DECLINED_TOKEN else '4242',
+            'exp_month': 12,
+            'exp_year': 2030,
+        })
+        if source == self.DECLINED_TOKEN:
+            self.declined_cards.add(card_id)
+        return card_id
+
+
+_gateway = None
+
+
+def get_gateway():
+    """Return the gateway selected by settings.PAYMENT_GATEWAY."""
+    global _gateway
+    if _gateway is None:
+        _gateway = import_string(settings.PAYMENT_GATEWAY)()
+    return _gateway
+
+
+def reset_gateway():
+    global _gateway
+    _gateway = None
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from . import catalog_cache
+from .models import Item, ItemVariation
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = (
+    # (content type, PIL format, extension)
+    ('image/webp', 'WEBP', 'webp'),
+    ('image/jpeg', 'JPEG', 'jpg'),
+)
+
+# (model, image field, field holding its renditions)
+RENDITION_FIELDS = (
+    (Item, 'image', 'image_renditions'),
+    (ItemVariation, 'attachment', 'attachment_renditions'),
+)
+
+
+def load_renditions(value):
+    """{'source': name, content type: {width: name}} or {} without any."""
+    return json.loads(value) if value else {}
+
+
+def srcset(renditions, request=None):
+    """{content type: srcset} for the renditions of an image."""
+    result = {}
+    for content_type, _, _ in FORMATS:
+        widths = renditions.get(content_type)
+        if not widths:
+            continue
+        candidates = []
+        for width, name in sorted(widths.items(), key=lambda w: int(w[0])):
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            candidates.append(f'{url} {width}w')
+        result[content_type] = ', '.join(candidates)
+    return result
+
+
+def is_stale(instance, image_field, renditions_field):
+    name = getattr(instance, image_field).name or ''
+    renditions = load_renditions(getattr(instance, renditions_field))
+    return renditions.get('source', '') != name
+
+
+def render(field_file):
+    """Save the resized copies of an image next to it, returns their map."""
+    storage = field_file.storage
+    with storage.open(field_file.name) as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        # jpeg has no alpha, transparent pixels go white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.split()[-1])
+        image = background
+
+    root = os.path.splitext(field_file.name)[0]
+    renditions = {'source': field_file.name}
+    # never upscaled, images narrower than a width get a copy at their own
+    for width in sorted({min(width, image.width)
+                         for width in settings.IMAGE_RENDITION_WIDTHS}):
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+
+        for content_type, image_format, extension in FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, image_format,
+                         quality=settings.IMAGE_RENDITION_QUALITY,
+                         optimize=True)
+            name = f'{root}.{width}w.{extension}'
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(buffer.getvalue()))
+            renditions.setdefault(content_type, {})[str(width)] = name
+    return renditions
+
+
+def delete_renditions(storage, renditions, keep=()):
+    for content_type, _, _ in FORMATS:
+        for name in renditions.get(content_type, {}).values():
+            if name not in keep:
+                storage.delete(name)
+
+
+def build_renditions(model, pk, image_field, renditions_field):
+    """Generate the renditions of one instance's image, replacing the old."""
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+
+    field_file = getattr(instance, image_field)
+    old = load_renditions(getattr(instance, renditions_field))
+    renditions = render(field_file) if field_file else {}
+
+    keep = {name for content_type, _, _ in FORMATS
+            for name in renditions.get(content_type, {}).values()}
+    delete_renditions(field_file.storage, old, keep)
+
+    # skipped when the image was replaced meanwhile, its own job follows
+    model.objects.filter(
+        pk=pk, **{image_field: field_file.name or ''}
+    ).update(**{renditions_field: json.dumps(renditions) if renditions
+                else ''})
+
+    # the catalog responses embed the srcset
+    if model is Item:
+        catalog_cache.item_changed(model, instance)
+    else:
+        catalog_cache.item_variation_changed(model, instance)
+
+
+def run_job(*args):
+    try:
+        build_renditions(*args)
+    except Exception:
+        logger.exception('Generating the renditions of %s failed', args[:2])
+    finally:
+        # the worker threads open their own connection
+        connection.close()
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_RENDITION_WORKERS,
+            thread_name_prefix='renditions')
+    return _executor
+
+
+def schedule_renditions(sender, instance, update_fields=None, **kwargs):
+    for model, image_field, renditions_field in RENDITION_FIELDS:
+        if sender is model:
+            break
+    else:
+        return
+
+    if update_fields and image_field not in update_fields:
+        return
+    if not is_stale(instance, image_field, renditions_field):
+        return
+
+    args = (model, instance.pk, image_field, renditions_field)
+    if settings.IMAGE_RENDITIONS_EAGER:
+        build_renditions(*args)
+    else:
+        # resized off the request thread, once the upload is committed
+        transaction.on_commit(lambda: get_executor().submit(run_job, *args))
@@ -0,0 +1,140 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from core import benchmark
+from core.gateway import reset_gateway
+
+
+BENCHMARK_SETTINGS = {
+    # keep the real caches and the payment gateway out of it
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark',
+        },
+        'catalog': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark-catalog',
+        },
+    },
+    'CATALOG_CACHE_ALIAS': 'catalog',
+    'PAYMENT_GATEWAY': 'core.gateway.FakeGateway',
+    'PAYMENT_JOBS_EAGER': False,
+}
+
+
+class Command(BaseCommand):
+    help = ('Measure the query count, wall time and memory of every API '
+            'endpoint on a synthetic data set, and fail when the query '
+            'counts regress from the stored baseline. Time and memory '
+            'regressions are warnings unless --strict is passed.')
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_SCALE.items():
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int,
+                                dest=name,
+                                help=f'Defaults to the baseline scale, '
+                                     f'or {default}.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed requests per endpoint.')
+        parser.add_argument('--baseline', default=benchmark.BASELINE_PATH)
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Store the results as the new baseline.')
+        parser.add_argument('--time-tolerance', type=float, default=0.5)
+        parser.add_argument('--memory-tolerance', type=float, default=0.25)
+        parser.add_argument('--strict', action='store_true',
+                            help='Fail on time and memory regressions too, '
+                                 'for a baseline taken on this machine.')
+
+    def handle(self, *args, **options):
+        baseline = benchmark.load_baseline(options['baseline'])
+
+        scale = dict(baseline['scale'] if baseline
+                     else benchmark.DEFAULT_SCALE)
+        for name in scale:
+            if options[name] is not None:
+                scale[name] = options[name]
+        if min(scale['users'], scale['items'], scale['cart_lines'],
+               scale['orders']) < 1:
+            raise CommandError('The users, items, cart lines and orders '
+                               'must be at least 1.')
+
+        if (baseline and baseline['scale'] != scale and
+                not options['update_baseline']):
+            raise CommandError(
+                f"The baseline was recorded at {baseline['scale']}, run at "
+                f"that scale or pass --update-baseline.")
+
+        results = self.run(scale, options['repeat'])
+        self.report(results, baseline)
+
+        if options['update_baseline']:
+            benchmark.save_baseline(results, scale, options['baseline'])
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+
+        if baseline is None:
+            self.stdout.write('No baseline to compare with, pass '
+                              '--update-baseline to store one.')
+            return
+
+        regressions, warnings = benchmark.compare(
+            results, baseline, options['time_tolerance'],
+            options['memory_tolerance'])
+        if options['strict']:
+            regressions, warnings = regressions + warnings, []
+        if warnings:
+            self.stdout.write(self.style.WARNING(
+                'Slower than the baseline, which may come from this '
+                'machine:\n' + '\n'.join(warnings)))
+        if regressions:
+            raise CommandError('Regressions from the baseline:\n' +
+                               '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions.'))
+
+    def run(self, scale, repeat):
+        # a throwaway database, like the test runner's. A sqlite database
+        # file connected to by mistake is removed again
+        database_file = (connection.settings_dict['NAME']
+                         if connection.vendor == 'sqlite' else None)
+        if database_file and os.path.exists(database_file):
+            database_file = None
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                reset_gateway()
+                try:
+                    fixture = benchmark.seed(**scale)
+                    return benchmark.run(fixture, repeat)
+                finally:
+                    reset_gateway()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            connection.close()
+            if database_file and os.path.exists(database_file):
+                os.remove(database_file)
+
+    def report(self, results, baseline):
+        expected = baseline['endpoints'] if baseline else {}
+
+        self.stdout.write(f"{'endpoint':<28}{'status':>7}{'queries':>9}"
+                          f"{'ms':>10}{'KB':>10}")
+        for name, result in results.items():
+            line = (f"{name:<28}{result['status']:>7}"
+                    f"{result['queries']:>9}{result['time_ms']:>10.2f}"
+                    f"{result['memory_kb']:>10.0f}")
+            if name in expected:
+                line += (f"  (baseline {expected[name]['queries']} queries, "
+                         f"{expected[name]['time_ms']:.2f} ms)")
+            self.stdout.write(line)
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.exports import FORMATS, export_orders
+from core.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Write the orders with their lines, totals and payment as CSV '
+            'or JSON lines, streamed from the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS),
+                            default='csv')
+        parser.add_argument('--output', '-o',
+                            help='File to write to, standard output if '
+                                 'omitted.')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Orders read per query.')
+        parser.add_argument('--include-carts', action='store_true',
+                            help='Export the open orders too.')
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if not options['include_carts']:
+            queryset = queryset.filter(ordered=True)
+        chunks = export_orders(queryset, options['format'],
+                               options['chunk_size'])
+
+        start = time.perf_counter()
+        if options['output']:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        self.stderr.write(
+            f'Exported in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.images import RENDITION_FIELDS, build_renditions, is_stale
+
+
+class Command(BaseCommand):
+    help = ('Generate the resized copies of the item images and variation '
+            'attachments missing them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate the existing renditions too.')
+
+    def handle(self, *args, **options):
+        for model, image_field, renditions_field in RENDITION_FIELDS:
+            done = failed = 0
+            instances = model.objects.exclude(
+                **{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+
+            for instance in instances.only(
+                    'pk', image_field, renditions_field).iterator():
+                if not (options['force'] or
+                        is_stale(instance, image_field, renditions_field)):
+                    continue
+                try:
+                    build_renditions(model, instance.pk, image_field,
+                                     renditions_field)
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(
+                        f'{model.__name__} {instance.pk}: {e}')
+
+            self.stdout.write(f'{model.__name__}: {done} generated, '
+                              f'{failed} failed')
@@ -0,0 +1,59 @@
+import sys
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.catalog_import import READERS, import_catalog
+
+
+class Command(BaseCommand):
+    help = ('Create or update the items, variations and variation values of '
+            'a CSV or JSON lines catalog feed, matching items by slug.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file, '-' for standard input.")
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Taken from the file extension if omitted.')
+        parser.add_argument('--batch-size', type=int,
+                            help='Items written per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format'] or path.rpartition('.')[2]
+        if feed_format not in READERS:
+            raise CommandError('Pass --format, the feed extension is not one '
+                               'of ' + ', '.join(sorted(READERS)))
+
+        f = sys.stdin if path == '-' else open(path, newline='',
+                                                encoding='utf-8')
+        totals, start = Counter(), time.perf_counter()
+        try:
+            records = READERS[feed_format](f)
+            for counts, errors in import_catalog(records,
+                                                 options['batch_size']):
+                for error in errors:
+                    self.stderr.write(error)
+                totals.update(counts)
+                self.stdout.write(self.progress(totals, start))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        self.stdout.write(
+            f"{totals['created']} items created, {totals['updated']} "
+            f"updated, {totals['unchanged']} unchanged, {totals['failed']} "
+            f"failed; {totals['variations_created']} variations and "
+            f"{totals['values_created']} values created, "
+            f"{totals['values_updated']} values updated")
+        if any(totals[key] for key in ('created', 'updated', 'values_created',
+                                       'values_updated')):
+            # the bulk queries skip the signal scheduling them
+            self.stdout.write('Run generate_renditions for the new images.')
+
+    def progress(self, totals, start):
+        items = sum(totals[key] for key in
+                    ('created', 'updated', 'unchanged', 'failed'))
+        elapsed = time.perf_counter() - start
+        return (f'{items} items in {elapsed:.1f}s '
+                f'({items / elapsed if elapsed else 0:.0f} items/s)')
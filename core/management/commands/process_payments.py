@@ -0,0 +1,52 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.api.idempotency import purge_expired_keys
+from core.metrics import multiprocess_dir
+from core.payments import process_pending_payments
+
+
+class Command(BaseCommand):
+    help = ('Charge the pending checkout payments through the gateway and '
+            'delete the expired idempotency keys. The gateway metrics are '
+            'served by the web workers, from PROMETHEUS_MULTIPROC_DIR.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the pending payments and exit.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when there is nothing to do.')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--purge-interval', type=float, default=3600.0,
+                            help='Seconds between two purges of the expired '
+                                 'idempotency keys.')
+
+    def handle(self, *args, **options):
+        directory = multiprocess_dir()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        else:
+            self.stderr.write('PROMETHEUS_MULTIPROC_DIR is not set, the '
+                              'gateway metrics of this worker are not '
+                              'exported.')
+
+        purged_at = None
+        while True:
+            if (purged_at is None or time.monotonic() - purged_at
+                    >= options['purge_interval']):
+                purged = purge_expired_keys()
+                purged_at = time.monotonic()
+                if purged:
+                    self.stdout.write(f'Deleted {purged} expired '
+                                      f'idempotency key(s)')
+
+            count = process_pending_payments(limit=options['batch_size'])
+            if count:
+                self.stdout.write(f'Processed {count} payment(s)')
+
+            if options['once']:
+                break
+            if not count:
+                time.sleep(options['interval'])
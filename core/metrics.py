@@ -0,0 +1,87 @@
+import functools
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+REQUEST_LATENCY = Histogram(
+    'django_request_latency_seconds', 'Request latency by URL name.',
+    ['url_name', 'method'])
+REQUESTS = Counter(
+    'django_requests_total', 'Responses by URL name and status.',
+    ['url_name', 'method', 'status'])
+REQUEST_QUERIES = Histogram(
+    'django_request_db_queries', 'Database queries per request.',
+    ['url_name'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, float('inf')))
+CATALOG_CACHE_LOOKUPS = Counter(
+    'catalog_cache_lookups_total', 'Catalog cache lookups by result.',
+    ['result'])
+GATEWAY_LATENCY = Histogram(
+    'payment_gateway_call_seconds', 'Payment gateway call latency.',
+    ['operation'])
+GATEWAY_ERRORS = Counter(
+    'payment_gateway_errors_total', 'Failed payment gateway calls.',
+    ['operation', 'error'])
+CART_MUTATIONS = Counter(
+    'cart_mutations_total', 'Cart changes by kind.', ['action'])
+
+
+def multiprocess_dir():
+    # prometheus_client reads the lowercase name up to 0.9
+    return (os.environ.get('PROMETHEUS_MULTIPROC_DIR') or
+            os.environ.get('prometheus_multiproc_dir'))
+
+
+def render():
+    """The metrics in the text exposition format, with its content type.
+
+    Under gunicorn every worker writes its samples to the multiprocess
+    directory and they're added up here, whichever worker serves the
+    scrape.
+    """
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def gateway_call(operation):
+    """Time a payment gateway method and count its errors by class."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                GATEWAY_ERRORS.labels(operation, type(e).__name__).inc()
+                raise
+            finally:
+                GATEWAY_LATENCY.labels(operation).observe(
+                    time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def cart_mutation(quantity, lines):
+    """Count a change applied through Order.update_summary()."""
+    if lines > 0:
+        action = 'add_line'
+    elif lines < 0:
+        action = 'remove_line'
+    elif quantity > 0:
+        action = 'increment'
+    else:
+        action = 'decrement'
+    CART_MUTATIONS.labels(action).inc()
@@ -0,0 +1,202 @@
+import heapq
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+logger = logging.getLogger('core.sql')
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+SPACE_RE = re.compile(r'\s+')
+
+UNRESOLVED = '<unresolved>'
+
+
+def fingerprint(sql):
+    """The statement with its values left out.
+
+    Statements differing only in their parameters, like the queries of an
+    N+1 loop, share a fingerprint.
+    """
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql.replace('%s', '?'))
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryProfile:
+    """execute_wrapper timing every statement of a request."""
+
+    def __init__(self, slowest=3):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.slowest_size = slowest
+        self._slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[fingerprint(sql)] += 1
+
+            entry = (duration, self.count, sql)
+            if len(self._slowest) < self.slowest_size:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def duplicates(self):
+        """{fingerprint: executions} of the statements run more than once."""
+        return {sql: count for sql, count in self.fingerprints.items()
+                if count > 1}
+
+    @property
+    def slowest(self):
+        """[(seconds, sql)] of the slowest statements, slowest first."""
+        return [(duration, sql) for duration, _, sql
+                in sorted(self._slowest, reverse=True)]
+
+
+class ProfileStats:
+    """Totals of the request profiles per URL name, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, name, profile):
+        duplicates = sum(count - 1 for count in profile.duplicates.values())
+        with self._lock:
+            view = self._views.setdefault(name, {
+                'requests': 0,
+                'queries': 0,
+                'db_time_ms': 0.0,
+                'max_queries': 0,
+                'duplicate_queries': 0,
+            })
+            view['requests'] += 1
+            view['queries'] += profile.count
+            view['db_time_ms'] += profile.duration * 1000
+            view['max_queries'] = max(view['max_queries'], profile.count)
+            view['duplicate_queries'] += duplicates
+
+    def snapshot(self):
+        with self._lock:
+            views = {name: dict(view) for name, view in self._views.items()}
+
+        for view in views.values():
+            view['avg_queries'] = view['queries'] / view['requests']
+            view['avg_db_time_ms'] = view['db_time_ms'] / view['requests']
+        return views
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+profile_stats = ProfileStats()
+
+
+def get_url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNRESOLVED
+
+
+class QueryProfilerMiddleware:
+    """Profile the SQL run by each request.
+
+    Records the query count, the time spent in the database, the statements
+    run more than once and the slowest ones. They're sent back as X-DB-*
+    headers when SQL_PROFILER_HEADERS is set, logged to the `core.sql`
+    logger otherwise, and added up per URL name in `profile_stats`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SQL_PROFILER_ENABLED:
+            return self.get_response(request)
+
+        profile = QueryProfile(settings.SQL_PROFILER_SLOWEST)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+
+        name = get_url_name(request)
+        profile_stats.record(name, profile)
+        metrics.REQUEST_QUERIES.labels(name).observe(profile.count)
+
+        if settings.SQL_PROFILER_HEADERS:
+            self.add_headers(response, profile)
+        else:
+            self.log(request, response, name, profile)
+        return response
+
+    def add_headers(self, response, profile):
+        response['X-DB-Queries'] = str(profile.count)
+        response['X-DB-Time-Ms'] = f'{profile.duration * 1000:.2f}'
+        response['X-DB-Duplicate-Queries'] = str(
+            sum(count - 1 for count in profile.duplicates.values()))
+        for i, (duration, sql) in enumerate(profile.slowest, 1):
+            # header values are a single line of latin-1
+            sql = fingerprint(sql)[:200].encode(
+                'latin-1', 'replace').decode('latin-1')
+            response[f'X-DB-Slowest-{i}'] = f'{duration * 1000:.2f}ms {sql}'
+
+    def log(self, request, response, name, profile):
+        duplicates = profile.duplicates
+        db_time_ms = profile.duration * 1000
+        record = {
+            'url_name': name,
+            'method': request.method,
+            'status': response.status_code,
+            'queries': profile.count,
+            'db_time_ms': round(db_time_ms, 2),
+            'duplicates': [{'sql': sql, 'count': count}
+                           for sql, count in duplicates.items()],
+            'slowest': [{'sql': fingerprint(sql),
+                         'ms': round(duration * 1000, 2)}
+                        for duration, sql in profile.slowest],
+        }
+
+        level = logging.INFO
+        if duplicates or db_time_ms > settings.SQL_PROFILER_SLOW_MS:
+            level = logging.WARNING
+        logger.log(level, json.dumps(record))
+
+
+class RequestMetricsMiddleware:
+    """Export the latency and status of each request, see core.metrics."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+
+        name = get_url_name(request)
+        metrics.REQUEST_LATENCY.labels(name, request.method).observe(
+            time.perf_counter() - start)
+        metrics.REQUESTS.labels(name, request.method,
+                                response.status_code).inc()
+        return response
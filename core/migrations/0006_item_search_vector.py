@@ -0,0 +1,42 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    from django.conf import settings
+    from django.contrib.postgres.search import SearchVector
+
+    config = settings.SEARCH_CONFIG
+    Item = apps.get_model('core', 'Item')
+    Item.objects.update(
+        search_vector=(SearchVector('title', weight='A', config=config) +
+                       SearchVector('description', weight='B', config=config)))
+    schema_editor.execute(
+        'CREATE INDEX core_item_search_vector_idx '
+        'ON core_item USING gin (search_vector)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS core_item_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_item_cursor_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
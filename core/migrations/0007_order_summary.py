@@ -0,0 +1,73 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:24
+
+from django.db import migrations, models
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+
+
+def fill_order_summaries(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    Coupon = apps.get_model('core', 'Coupon')
+
+    lines = OrderItem.objects.filter(
+        order=OuterRef('pk')).order_by().values('order')
+
+    def sum_lines(expression):
+        return Coalesce(Subquery(lines.annotate(
+            line_sum=Sum(expression, output_field=models.FloatField())
+        ).values('line_sum'), output_field=models.FloatField()), Value(0.0))
+
+    subtotal = sum_lines(F('quantity') * F('item__price'))
+    discount = sum_lines(
+        F('quantity') * Coalesce(F('item__discount_price'), Value(0.0)))
+    coupon_amount = Coalesce(Subquery(Coupon.objects.filter(
+        pk=OuterRef('coupon')).values('amount')), Value(0.0))
+
+    Order.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(
+            line_count=Count('pk')).values('line_count')), Value(0)),
+        subtotal=subtotal,
+        discount=discount,
+        total=ExpressionWrapper(subtotal - discount - coupon_amount,
+                                output_field=models.FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_item_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_order_summaries, migrations.RunPython.noop),
+    ]
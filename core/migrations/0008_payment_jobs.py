@@ -0,0 +1,56 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+def mark_existing_payments_succeeded(apps, schema_editor):
+    # payments used to be recorded only after a successful charge
+    Payment = apps.get_model('core', 'Payment')
+    Payment.objects.update(status='S')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_order_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='failure_message',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='save_source',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='source',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('R', 'Processing'), ('S', 'Succeeded'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='use_customer',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_charge_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(mark_existing_payments_succeeded,
+                             migrations.RunPython.noop),
+    ]
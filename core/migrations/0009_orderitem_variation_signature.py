@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_payment_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='variation_signature',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -0,0 +1,43 @@
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_variation_signatures(apps, schema_editor):
+    OrderItem = apps.get_model('core', 'OrderItem')
+    Order = apps.get_model('core', 'Order')
+    through = OrderItem.item_variations.through
+
+    variation_ids = {}
+    for order_item_id, item_variation_id in through.objects.values_list(
+            'orderitem_id', 'itemvariation_id').iterator():
+        variation_ids.setdefault(order_item_id, []).append(item_variation_id)
+
+    for pk, ids in variation_ids.items():
+        ids = ','.join(str(i) for i in sorted(set(ids)))
+        OrderItem.objects.filter(pk=pk).update(
+            variation_signature=hashlib.sha1(ids.encode()).hexdigest())
+
+    # open lines that were taken out of their cart used to be left behind,
+    # cart lines are now looked up by user and would pick them up again
+    in_orders = Order.items.through.objects.values('orderitem_id')
+    OrderItem.objects.filter(ordered=False).exclude(
+        pk__in=in_orders).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0009_orderitem_variation_signature'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_variation_signatures,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['user', 'ordered', 'item', 'variation_signature'], name='core_orderitem_cart_line_idx'),
+        ),
+    ]
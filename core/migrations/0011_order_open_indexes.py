@@ -0,0 +1,90 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_open_orders(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    through = Order.items.through
+
+    users = Order.objects.filter(ordered=False).values('user').annotate(
+        open_orders=Count('pk')).filter(open_orders__gt=1).values_list(
+            'user', flat=True)
+
+    for user_id in list(users):
+        # keep the order a payment may already be running for, the oldest
+        # one otherwise as that's the one the cart views were using
+        orders = sorted(
+            Order.objects.filter(user=user_id, ordered=False),
+            key=lambda order: (order.payment_id is None, order.pk))
+        order, others = orders[0], [other.pk for other in orders[1:]]
+
+        if order.coupon_id is None:
+            order.coupon_id = Order.objects.filter(
+                pk__in=others, coupon__isnull=False
+            ).values_list('coupon', flat=True).first()
+
+        kept = through.objects.filter(order=order).values('orderitem_id')
+        through.objects.filter(order__in=others,
+                               orderitem__in=kept).delete()
+        through.objects.filter(order__in=others).update(order=order)
+        Order.objects.filter(pk__in=others).delete()
+
+        # lines for the same item and variations add up into one
+        lines = {}
+        for order_item in OrderItem.objects.filter(
+                order=order).select_related('item').order_by('pk'):
+            key = (order_item.item_id, order_item.variation_signature)
+            if key in lines:
+                lines[key].quantity += order_item.quantity
+                lines[key].save()
+                order_item.delete()
+            else:
+                lines[key] = order_item
+
+        subtotal = sum(line.quantity * line.item.price
+                       for line in lines.values())
+        discount = sum(line.quantity * (line.item.discount_price or 0)
+                       for line in lines.values())
+        coupon_amount = order.coupon.amount if order.coupon_id else 0
+
+        order.item_count = len(lines)
+        order.subtotal = subtotal
+        order.discount = discount
+        order.total = subtotal - discount - coupon_amount
+        order.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_orderitem_cart_line_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_open_orders, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, db_index=True, max_length=24, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'address_type', 'default'], name='core_address_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered'], name='core_order_user_ordered_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user',), name='core_order_one_open_per_user'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_order_open_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='itemvariation',
+            name='attachment_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
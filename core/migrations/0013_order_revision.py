@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
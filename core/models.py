@@ -1,9 +1,26 @@
-from django.db import models
-from django.db.models.signals import post_save
+import hashlib
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, m2m_changed
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.shortcuts import reverse
 from django_countries.fields import CountryField
 
+from .metrics import cart_mutation
+
 
 User = get_user_model()
 
@@ -36,6 +53,11 @@ class Item(models.Model):
     description = models.TextField()
     image = models.ImageField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # maintained by core.search, only populated on postgres
+    search_vector = SearchVectorField(null=True, editable=False)
+    # resized copies of image, maintained by core.images
+    image_renditions = models.TextField(blank=True, default='',
+                                        editable=False)
 
     def __str__(self):
         return self.title
@@ -50,7 +72,11 @@ class Item(models.Model):
         return reverse('core:remove_from_cart', kwargs={'slug': self.slug})
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'],
+                         name='core_item_created_id_idx'),
+        ]
 
 
 class Variation(models.Model):
@@ -68,6 +94,9 @@ class ItemVariation(models.Model):
     variation = models.ForeignKey(Variation, on_delete=models.CASCADE)
     value = models.CharField(max_length=50)
     attachment = models.ImageField(null=True, blank=True)
+    # resized copies of attachment, maintained by core.images
+    attachment_renditions = models.TextField(blank=True, default='',
+                                             editable=False)
 
     class Meta:
         unique_together = ['variation', 'value']
@@ -82,10 +111,44 @@ class OrderItem(models.Model):
     item_variations = models.ManyToManyField(ItemVariation)
     quantity = models.PositiveIntegerField(default=1)
     ordered = models.BooleanField(default=False)
+    # identifies the set of item_variations, see make_variation_signature()
+    variation_signature = models.CharField(max_length=40, blank=True,
+                                           default='')
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'ordered', 'item', 'variation_signature'],
+                name='core_orderitem_cart_line_idx'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} of '{self.item.title}'"
 
+    @staticmethod
+    def make_variation_signature(item_variation_ids):
+        """Hash of the sorted ItemVariation ids, empty without variations."""
+        if not item_variation_ids:
+            return ''
+        ids = ','.join(str(pk) for pk in sorted(set(item_variation_ids)))
+        return hashlib.sha1(ids.encode()).hexdigest()
+
+    @classmethod
+    def refresh_variation_signatures(cls, order_item_ids):
+        """Recompute the signature of the lines from their item_variations."""
+        through = cls.item_variations.through
+        variation_ids = {pk: [] for pk in order_item_ids}
+        for order_item_id, item_variation_id in through.objects.filter(
+                orderitem__in=order_item_ids).values_list(
+                    'orderitem_id', 'itemvariation_id'):
+            variation_ids[order_item_id].append(item_variation_id)
+
+        for pk, ids in variation_ids.items():
+            signature = cls.make_variation_signature(ids)
+            cls.objects.filter(pk=pk).exclude(
+                variation_signature=signature
+            ).update(variation_signature=signature)
+
     def get_total_item_price(self):
         return self.quantity * self.item.price
 
@@ -103,6 +166,82 @@ class OrderItem(models.Model):
         return self.get_total_item_price()
 
 
+def order_lines():
+    return OrderItem.objects.filter(
+        order=OuterRef('pk')).order_by().values('order')
+
+
+def sum_order_lines(expression):
+    """Sum `expression` over the lines of the outer order."""
+    subquery = Subquery(order_lines().annotate(
+        line_sum=Sum(expression, output_field=models.FloatField())
+    ).values('line_sum'), output_field=models.FloatField())
+    return Coalesce(subquery, Value(0.0))
+
+
+def order_line_totals():
+    subtotal = sum_order_lines(F('quantity') * F('item__price'))
+    discount = sum_order_lines(
+        F('quantity') * Coalesce(F('item__discount_price'), Value(0.0)))
+    return subtotal, discount
+
+
+def cart_prefetch():
+    """Prefetch of the order lines with their items and variations."""
+    item_variations = ItemVariation.objects.select_related('variation')
+    order_items = OrderItem.objects.select_related('item').prefetch_related(
+        models.Prefetch('item_variations', queryset=item_variations))
+    return models.Prefetch('items', queryset=order_items)
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate the order totals, computed by the database.
+
+        `computed_subtotal` is the sum of the line prices before discounts,
+        `computed_discount` the sum of the line discounts and
+        `computed_total` what get_total() returns, coupon included.
+        """
+        subtotal, discount = order_line_totals()
+
+        return self.annotate(
+            computed_subtotal=subtotal,
+            computed_discount=discount,
+            computed_total=ExpressionWrapper(
+                subtotal - discount - Coalesce(F('coupon__amount'), Value(0.0)),
+                output_field=models.FloatField()),
+        )
+
+    def refresh_summaries(self):
+        """Recompute the stored cart summary from the order lines.
+
+        Runs as a single UPDATE, for when a change the cart views don't
+        track (such as a price edit) invalidates the stored summary.
+        """
+        subtotal, discount = order_line_totals()
+        item_count = Coalesce(Subquery(order_lines().annotate(
+            line_count=Count('pk')).values('line_count')), Value(0))
+        coupon_amount = Coalesce(Subquery(Coupon.objects.filter(
+            pk=OuterRef('coupon')).values('amount')), Value(0.0))
+
+        return self.update(
+            item_count=item_count,
+            subtotal=subtotal,
+            discount=discount,
+            total=ExpressionWrapper(subtotal - discount - coupon_amount,
+                                    output_field=models.FloatField()),
+            revision=F('revision') + 1,
+        )
+
+    def with_cart(self):
+        """Fetch the order lines with their items and variations up front.
+
+        The whole cart graph loads in three queries however many lines
+        it has, so serializing it or calling get_total() costs nothing.
+        """
+        return self.select_related('coupon').prefetch_related(cart_prefetch())
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     items = models.ManyToManyField(OrderItem)
@@ -126,12 +265,82 @@ class Order(models.Model):
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
-    ref_code = models.CharField(max_length=24, blank=True, null=True)
+    ref_code = models.CharField(max_length=24, blank=True, null=True,
+                                db_index=True)
+
+    # cart summary, kept up to date by the cart views
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    total = models.FloatField(default=0)
+    # bumped on every summary change, the order summary ETag
+    revision = models.PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'ordered'],
+                         name='core_order_user_ordered_idx'),
+        ]
+        constraints = [
+            # a user has one cart at most, the partial unique index also
+            # serves the open order lookups
+            models.UniqueConstraint(fields=['user'],
+                                    condition=Q(ordered=False),
+                                    name='core_order_one_open_per_user'),
+        ]
 
     def __str__(self):
         return self.user.username
 
+    def update_summary(self, item, quantity=0, lines=0):
+        """Apply a cart change to the stored summary in a single UPDATE.
+
+        `quantity` is the number of units of `item` added to the cart,
+        negative when removed, and `lines` the number of order lines.
+        """
+        subtotal = quantity * item.price
+        discount = quantity * (item.discount_price or 0)
+
+        Order.objects.filter(pk=self.pk).update(
+            item_count=F('item_count') + lines,
+            subtotal=F('subtotal') + subtotal,
+            discount=F('discount') + discount,
+            total=F('total') + (subtotal - discount),
+            revision=F('revision') + 1,
+        )
+        self.clear_cart_cache()
+        cart_mutation(quantity, lines)
+
+    @property
+    def payment_pending(self):
+        """Whether the checkout payment of the order is yet to be charged."""
+        return self.payment is not None and self.payment.status in (
+            Payment.PENDING, Payment.PROCESSING)
+
+    def apply_coupon(self, coupon):
+        self.coupon = coupon
+        Order.objects.filter(pk=self.pk).update(
+            coupon=coupon,
+            total=F('subtotal') - F('discount') - coupon.amount,
+            revision=F('revision') + 1,
+        )
+
+    @staticmethod
+    def cart_cache_key(user_id):
+        return f'cart-item-count:{user_id}'
+
+    def clear_cart_cache(self):
+        # once committed, a badge read before that would cache the old count
+        key = self.cart_cache_key(self.user_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
     def get_total(self):
+        # computed by the database when loaded through with_totals()
+        if hasattr(self, 'computed_total'):
+            return self.computed_total
+
         total = 0
         for order_item in self.items.all():
             total += order_item.get_final_price()
@@ -157,20 +366,73 @@ class Address(models.Model):
 
     class Meta:
         verbose_name_plural = 'Addresses'
+        indexes = [
+            models.Index(fields=['user', 'address_type', 'default'],
+                         name='core_address_user_type_idx'),
+        ]
 
 
 class Payment(models.Model):
-    stripe_charge_id = models.CharField(max_length=50)
+    PENDING = 'P'
+    PROCESSING = 'R'
+    SUCCEEDED = 'S'
+    FAILED = 'F'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    stripe_charge_id = models.CharField(max_length=50, blank=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     amount = models.FloatField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # checkout job run by the payment worker, see core.payments
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES,
+                              default=PENDING)
+    # card token, cleared once the job ran
+    source = models.CharField(max_length=255, blank=True)
+    # charge the saved stripe customer instead of the token
+    use_customer = models.BooleanField(default=False)
+    # save the token on the stripe customer before charging
+    save_source = models.BooleanField(default=False)
+    failure_message = models.CharField(max_length=255, blank=True)
+    # when a worker claimed the job, a claim older than
+    # PAYMENT_CLAIM_TIMEOUT is given to another worker
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
     def __str__(self):
         return self.user.username
 
 
+class IdempotencyKey(models.Model):
+    """A client's Idempotency-Key and the response it was answered with."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # hash of the request, a key can't be reused for another one
+    request_fingerprint = models.CharField(max_length=64)
+    # indexed for purge_expired_keys()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    # empty while the request is being handled
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='core_idempotencykey_user_key'),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
 class Coupon(models.Model):
-    code = models.CharField(max_length=15)
+    code = models.CharField(max_length=15, db_index=True)
     amount = models.FloatField()
 
     def __str__(self):
@@ -202,3 +464,39 @@ def userprofile_receiver(sender, instance, created, *args, **kwargs):
 
 
 post_save.connect(userprofile_receiver, sender=User)
+
+
+def order_summary_receiver(sender, instance, created, *args, **kwargs):
+    # price and coupon edits change the summary of the open carts
+    if created:
+        return
+
+    if sender is Item:
+        orders = Order.objects.filter(ordered=False, items__item=instance)
+    else:
+        orders = Order.objects.filter(ordered=False, coupon=instance)
+    orders.refresh_summaries()
+
+
+post_save.connect(order_summary_receiver, sender=Item)
+post_save.connect(order_summary_receiver, sender=Coupon)
+
+
+def variation_signature_receiver(sender, instance, action, reverse, pk_set,
+                                 *args, **kwargs):
+    # keep OrderItem.variation_signature in step with item_variations
+    if action == 'pre_clear' and reverse:
+        instance._signature_order_items = list(
+            instance.orderitem_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            order_item_ids = [instance.pk]
+        elif action == 'post_clear':
+            order_item_ids = instance._signature_order_items
+        else:
+            order_item_ids = pk_set
+        OrderItem.refresh_variation_signatures(order_item_ids)
+
+
+m2m_changed.connect(variation_signature_receiver,
+                    sender=OrderItem.item_variations.through)
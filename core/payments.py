@@ -0,0 +1,225 @@
+import logging
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .checkout import finalize_order
+from .gateway import get_gateway
+from .models import Order, Payment
+
+
+logger = logging.getLogger(__name__)
+
+# message stored on a failed payment for each gateway error, card errors
+# carry their own message
+GATEWAY_ERROR_MESSAGES = (
+    # Too many requests made to the API too quickly
+    (stripe.error.RateLimitError, 'Rate limit error.'),
+    # Invalid parameters were supplied to Stripe's API
+    (stripe.error.InvalidRequestError, 'Invalid parameters.'),
+    # Authentication with Stripe's API failed
+    # (maybe you changed API keys recently)
+    (stripe.error.AuthenticationError, 'Not authenticated.'),
+    # Network communication with Stripe failed
+    (stripe.error.APIConnectionError, 'Network error.'),
+    (stripe.error.StripeError,
+     'Something went wrong. You were not charged. Plase try again.'),
+)
+
+
+class PaymentError(Exception):
+    def __init__(self, message, payment=None):
+        super().__init__(message)
+        # the payment in flight a duplicate checkout ran into
+        self.payment = payment
+
+
+SAVED_CARDS_CACHE_KEY = 'saved-cards:{}'
+SAVED_CARD_FIELDS = ('id', 'brand', 'last4', 'exp_month', 'exp_year')
+
+
+def submit_payment(user, source='', use_customer=False, save_source=False,
+                   billing_address=None, shipping_address=None):
+    """Record a pending payment for the user's open order and return it
+    right away.
+
+    The gateway is only contacted by the payment worker (the
+    process_payments command), or inline when PAYMENT_JOBS_EAGER is set.
+    The addresses given are recorded on the order along with the payment.
+
+    The order is locked meanwhile, PaymentError is raised without one or
+    while an earlier payment of it is pending. Until the payment ran the cart can't change
+    either, see core.cart.lock_cart().
+    """
+    with transaction.atomic():
+        order = Order.objects.with_totals().select_related(
+            'payment').select_for_update(of=('self',)).filter(
+                user=user, ordered=False).first()
+        if order is None:
+            raise PaymentError('You do not have an active order.')
+        if order.payment_pending:
+            raise PaymentError('Your payment is already being processed.',
+                               payment=order.payment)
+
+        payment = Payment.objects.create(
+            user=user,
+            amount=order.get_total(),
+            source=source or '',
+            use_customer=use_customer,
+            save_source=save_source,
+        )
+        changes = {'payment': payment}
+        if billing_address is not None:
+            changes['billing_address'] = billing_address
+        if shipping_address is not None:
+            changes['shipping_address'] = shipping_address
+        Order.objects.filter(pk=order.pk).update(**changes)
+
+    if settings.PAYMENT_JOBS_EAGER:
+        return process_payment(payment.pk)
+    return payment
+
+
+def requeue_stale_payments():
+    """Queue again the payments claimed by a worker that never finished.
+
+    Returns how many were queued.
+    """
+    expired = timezone.now() - timedelta(
+        seconds=settings.PAYMENT_CLAIM_TIMEOUT)
+    return Payment.objects.filter(
+        status=Payment.PROCESSING, claimed_at__lt=expired
+    ).update(status=Payment.PENDING, claimed_at=None)
+
+
+def process_pending_payments(limit=None):
+    """Run the pending payment jobs, oldest first. Returns how many ran."""
+    requeue_stale_payments()
+    pending = Payment.objects.filter(
+        status=Payment.PENDING).order_by('timestamp').values_list(
+            'pk', flat=True)
+    if limit:
+        pending = pending[:limit]
+
+    count = 0
+    for pk in list(pending):
+        process_payment(pk)
+        count += 1
+    return count
+
+
+def process_payment(payment_id):
+    # claiming the job is a single conditional UPDATE, so a payment is
+    # charged by one worker only however many of them run
+    claimed = Payment.objects.filter(
+        pk=payment_id, status=Payment.PENDING
+    ).update(status=Payment.PROCESSING, claimed_at=timezone.now())
+
+    payment = Payment.objects.select_related(
+        'user__userprofile').get(pk=payment_id)
+    if not claimed:
+        return payment
+
+    # the cart is locked while the payment is pending, a mismatch means
+    # the order was changed or paid by another payment
+    order = Order.objects.with_totals().filter(
+        payment=payment, ordered=False).first()
+    if order is None or (round(order.get_total(), 2) !=
+                         round(payment.amount, 2)):
+        return fail_payment(payment, 'Your order changed during checkout. '
+                                     'You were not charged.')
+
+    try:
+        charge_id = charge(payment)
+    except stripe.error.CardError as e:
+        # Since it's a decline, stripe.error.CardError will be caught
+        return fail_payment(payment, e.user_message)
+    except stripe.error.StripeError as e:
+        for error_class, message in GATEWAY_ERROR_MESSAGES:
+            if isinstance(e, error_class):
+                return fail_payment(payment, message)
+    except Exception:
+        logger.exception('Payment %s failed', payment.pk)
+        return fail_payment(
+            payment, 'A serious error occurred. We have been notified.')
+
+    payment.stripe_charge_id = charge_id
+    payment.status = Payment.SUCCEEDED
+    payment.source = ''
+    payment.processed_at = timezone.now()
+    with transaction.atomic():
+        payment.save()
+        finalize_order(payment)
+
+    return payment
+
+
+def charge(payment):
+    gateway = get_gateway()
+    userprofile = payment.user.userprofile
+    # the saved card to charge, the customer's default one without it
+    card_id = None
+
+    if payment.save_source:
+        # allow to fetch cards
+        if not userprofile.stripe_customer_id:
+            userprofile.stripe_customer_id = gateway.create_customer(
+                payment.user.email, payment.source)
+            userprofile.one_click_purchasing = True
+            userprofile.save()
+        else:
+            # a new card doesn't become the default one, charge it by id
+            card_id = gateway.add_source(userprofile.stripe_customer_id,
+                                         payment.source)
+
+        # the cards offered for one-click purchasing changed
+        try:
+            refresh_saved_cards(userprofile)
+        except stripe.error.StripeError:
+            # the next payment page view fetches them again
+            cache.delete(SAVED_CARDS_CACHE_KEY.format(userprofile.pk))
+
+    amount = int(payment.amount * 100)  # cents
+    # a payment queued again after its worker was lost is charged once
+    idempotency_key = f'payment-{payment.pk}'
+    if payment.use_customer:
+        return gateway.charge(amount,
+                              customer_id=userprofile.stripe_customer_id,
+                              source=card_id,
+                              idempotency_key=idempotency_key)
+    return gateway.charge(amount, source=payment.source,
+                          idempotency_key=idempotency_key)
+
+
+def fail_payment(payment, message):
+    payment.status = Payment.FAILED
+    payment.failure_message = (message or '')[:255]
+    payment.source = ''
+    payment.processed_at = timezone.now()
+    payment.save()
+    return payment
+
+
+def get_saved_cards(userprofile):
+    """Summary of the customer's cards, newest first.
+
+    Cached per profile for SAVED_CARDS_CACHE_TIMEOUT seconds, so the
+    payment page only waits on the gateway when the cache is cold.
+    """
+    cards = cache.get(SAVED_CARDS_CACHE_KEY.format(userprofile.pk))
+    if cards is None:
+        cards = refresh_saved_cards(userprofile)
+    return cards
+
+
+def refresh_saved_cards(userprofile):
+    cards = get_gateway().list_cards(userprofile.stripe_customer_id, limit=3)
+    cards = [{field: card[field] for field in SAVED_CARD_FIELDS}
+             for card in cards]
+    cache.set(SAVED_CARDS_CACHE_KEY.format(userprofile.pk), cards,
+              settings.SAVED_CARDS_CACHE_TIMEOUT)
+    return cards
@@ -0,0 +1,185 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+
+from .models import Item
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# title matches rank above description matches, same as the A/B weights
+# of the postgres search vector
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def item_search_vector():
+    config = settings.SEARCH_CONFIG
+    return (SearchVector('title', weight='A', config=config) +
+            SearchVector('description', weight='B', config=config))
+
+
+class InvertedIndex:
+    """In-process index used when the database has no full-text search.
+
+    Maps every token to the items containing it and the weight it scores
+    for each of them, built lazily from the Item table on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._built = False
+
+    def build(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for pk, title, description in Item.objects.values_list(
+                    'pk', 'title', 'description').iterator():
+                self._add(pk, title, description)
+            self._built = True
+
+    def update(self, pk, title, description):
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._add(pk, title, description)
+
+    def remove(self, pk):
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+
+    def reset(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._built = False
+
+    def search(self, q):
+        """Return {item pk: score} for items matching every query term.
+
+        Terms match as prefixes, like the `term:*` postgres query.
+        """
+        if not self._built:
+            self.build()
+
+        terms = tokenize(q)
+        if not terms:
+            return {}
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                matches = defaultdict(float)
+                for token, postings in self._postings.items():
+                    if token.startswith(term):
+                        for pk, weight in postings.items():
+                            matches[pk] += weight
+
+                if scores is None:
+                    scores = dict(matches)
+                else:
+                    scores = {pk: score + matches[pk]
+                              for pk, score in scores.items() if pk in matches}
+                if not scores:
+                    return {}
+        return scores
+
+    def _add(self, pk, title, description):
+        weights = defaultdict(float)
+        for token in tokenize(title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+
+        for token, weight in weights.items():
+            self._postings[token][pk] = weight
+        self._documents[pk] = set(weights)
+
+    def _remove(self, pk):
+        for token in self._documents.pop(pk, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[token]
+
+
+inverted_index = InvertedIndex()
+
+
+def search_items(queryset, q):
+    """Filter an Item queryset by `q`, best matches first.
+
+    Matching items are annotated with `search_rank`.
+    """
+    terms = tokenize(q)
+    if not terms:
+        return queryset.none()
+
+    if uses_postgres():
+        query = SearchQuery(' & '.join(f'{term}:*' for term in terms),
+                            config=settings.SEARCH_CONFIG,
+                            search_type='raw')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-created_at', '-id')
+
+    scores = inverted_index.search(q)
+    if not scores:
+        return queryset.none()
+
+    rank = Case(*[When(pk=pk, then=Value(score))
+                  for pk, score in scores.items()],
+                output_field=FloatField())
+    return queryset.filter(pk__in=scores).annotate(
+        search_rank=rank
+    ).order_by('-search_rank', '-created_at', '-id')
+
+
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'title', 'description'} & set(update_fields):
+        return
+
+    if uses_postgres():
+        Item.objects.filter(pk=instance.pk).update(
+            search_vector=item_search_vector())
+    else:
+        inverted_index.update(instance.pk, instance.title,
+                              instance.description)
+
+
+def reindex_items(pks):
+    """Index items saved without their signals, such as by bulk queries."""
+    if not pks:
+        return
+    if uses_postgres():
+        Item.objects.filter(pk__in=pks).update(
+            search_vector=item_search_vector())
+    else:
+        # rebuilt on the next search
+        inverted_index.reset()
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    if not uses_postgres():
+        inverted_index.remove(instance.pk)
@@ -1,13 +1,9 @@
 from django import template
-from core.models import Order
+from core.cart import get_cart_item_count
 
 
 register = template.Library()
 
 @register.filter
 def cart_item_count(user):
-    if user.is_authenticated:
-        qs = Order.objects.filter(user=user, ordered=False)
-        if qs.exists():
-            return qs[0].items.count()
-    return 0
+    return get_cart_item_count(user)
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, re_path, resolve
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+import stripe
+
+from core import benchmark, cart, catalog_cache
+from core.api import urls as api_urls
+from core.cart import (
+    CartError, add_to_cart, get_cart_item_count, remove_from_cart,
+)
+from core.catalog_import import import_catalog, read_csv
+from core.checkout import finalize_order
+from core.exports import export_orders
+from core.gateway import get_gateway, reset_gateway
+from core.middleware import fingerprint, profile_stats
+from core.payments import (
+    SAVED_CARDS_CACHE_KEY, PaymentError, get_saved_cards, process_payment,
+    process_pending_payments, submit_payment,
+)
+from core.search import inverted_index
+from core.views import ItemDetailView, serve_media
+from core.models import (
+    Address, Coupon, IdempotencyKey, Item, ItemVariation, Order, OrderItem,
+    Payment, Variation,
+)
+
+
+def create_item(slug='item', model=Item, **fields):
+    """An item, with defaults for the fields a test doesn't care about.
+
+    `model` is the historical Item in the migration tests.
+    """
+    fields = {'title': slug, 'price': 10, 'category': 'S', 'label': 'P',
+              'description': '', 'image': 'item.jpg', **fields}
+    return model.objects.create(slug=slug, **fields)
+
+
+urlpatterns = [
+    path('', include('core.urls')),
+    re_path(r'^media/(?P<path>.+)$', serve_media),
+]
+
+
+class ItemDetailAPIViewTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.client = APIClient()
+
+    def create_item(self, slug, variations, values):
+        item = create_item(slug)
+        for i in range(variations):
+            variation = Variation.objects.create(item=item, name=f'v{i}')
+            for j in range(values):
+                ItemVariation.objects.create(variation=variation,
+                                             value=f'{i}-{j}')
+        return item
+
+    def get_detail(self, item):
+        return self.client.get(f'/api/products/{item.pk}/')
+
+    def test_query_count_does_not_depend_on_variations(self):
+        small = self.create_item('small', variations=1, values=1)
+        large = self.create_item('large', variations=5, values=4)
+
+        with self.assertNumQueries(3):
+            response = self.get_detail(small)
+        self.assertEqual(len(response.data['variations']), 1)
+
+        with self.assertNumQueries(3):
+            response = self.get_detail(large)
+        self.assertEqual(len(response.data['variations']), 5)
+        for variation in response.data['variations']:
+            self.assertEqual(len(variation['item_variations']), 4)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        catalog_cache.lookups.clear()
+
+    def test_stats(self):
+        item = create_item('item')
+        for _ in range(3):
+            self.client.get(f'/api/products/{item.pk}/')
+
+        self.assertEqual(catalog_cache.stats(),
+                         {'hits': 2, 'misses': 1, 'hit_ratio': 2 / 3})
+
+    def test_product_page_is_cached_per_item(self):
+        item = create_item('item')
+        view = ItemDetailView(kwargs={'slug': 'item'})
+        self.assertEqual(view.get_object(), item)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(view.get_object(), item)
+
+        # another item changing only drops the slug lookup
+        create_item('other')
+        with self.assertNumQueries(1):
+            self.assertEqual(view.get_object(), item)
+
+        Item.objects.filter(pk=item.pk).update(title='renamed')
+        Item.objects.get(pk=item.pk).save()
+        self.assertEqual(view.get_object().title, 'renamed')
+
+
+class ItemListAPIViewTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.client = APIClient()
+        self.items = [
+            create_item(f'item-{i}', title=f'item {i}', description='text')
+            for i in range(5)
+        ]
+
+    def test_cursor_pages(self):
+        url, pages = '/api/products/?page_size=2', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item['id'] for item in response.data['results']])
+            url = response.data['next']
+            if url:
+                self.assertIn('cursor=', url)
+
+        # newest first, every item exactly once
+        ids = [item.pk for item in reversed(self.items)]
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/?fields=id,title')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+        sql = [query['sql'] for query in queries if 'core_item' in query['sql']]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('description', sql[0])
+
+        response = self.client.get('/api/products/?fields=id,unknown')
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        inverted_index.reset()
+        self.client = APIClient()
+
+    def create_item(self, slug, title, description):
+        return create_item(slug, title=title, description=description)
+
+    def search(self, q):
+        response = self.client.get('/api/products/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [item['slug'] for item in response.data['results']]
+
+    def test_ranked_results(self):
+        self.create_item('coat', 'Rain coat', 'Keeps a shirt dry')
+        self.create_item('shirt', 'Blue shirt', 'Cotton')
+        self.create_item('hat', 'Hat', 'Wool')
+
+        # title matches rank above description matches
+        self.assertEqual(self.search('shirt'), ['shirt', 'coat'])
+        # every term has to match
+        self.assertEqual(self.search('blue shirt'), ['shirt'])
+        self.assertEqual(self.search('socks'), [])
+
+    def test_prefix_matching(self):
+        self.create_item('shirt', 'Blue shirt', 'Cotton')
+        self.assertEqual(self.search('shi'), ['shirt'])
+        self.assertEqual(self.search('cott blu'), ['shirt'])
+
+    def test_index_follows_item_changes(self):
+        item = self.create_item('shirt', 'Blue shirt', 'Cotton')
+        self.assertEqual(self.search('blue'), ['shirt'])
+
+        item.title = 'Red shirt'
+        item.save()
+        self.assertEqual(self.search('blue'), [])
+        self.assertEqual(self.search('red'), ['shirt'])
+
+        item.delete()
+        self.assertEqual(self.search('red'), [])
+
+
+class CartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        self.item = create_item()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSummary(self, item_count, total):
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual((order.item_count, order.total), (item_count, total))
+
+    def test_remove_from_cart(self):
+        add_to_cart(self.user, self.item)
+        add_to_cart(self.user, self.item)
+
+        self.assertFalse(remove_from_cart(self.user, self.item, single=True))
+        self.assertEqual(OrderItem.objects.get().quantity, 1)
+        self.assertSummary(1, 10)
+
+        self.assertTrue(remove_from_cart(self.user, self.item, single=True))
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertSummary(0, 0)
+
+        with self.assertRaises(CartError):
+            remove_from_cart(self.user, self.item)
+
+    def test_delete_line(self):
+        add_to_cart(self.user, self.item)
+        add_to_cart(self.user, self.item)
+        order_item = OrderItem.objects.get()
+
+        response = self.client.delete(
+            f'/api/order-items/{order_item.pk}/delete/')
+        self.assertEqual(response.status_code, 204)
+        self.assertSummary(0, 0)
+
+    def test_summary_query_count_does_not_depend_on_lines(self):
+        size = Variation.objects.create(item=self.item, name='size')
+        values = [ItemVariation.objects.create(variation=size, value=value)
+                  for value in 'SML']
+        add_to_cart(self.user, self.item, [values[0].pk])
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/order-summary/')
+        self.assertEqual(len(response.data['order_items']), 1)
+
+        for value in values[1:]:
+            add_to_cart(self.user, self.item, [value.pk])
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/order-summary/')
+        self.assertEqual(len(response.data['order_items']), 3)
+
+    @override_settings(ROOT_URLCONF='core.tests')
+    def test_checkout_only_writes_the_addresses(self):
+        add_to_cart(self.user, self.item)
+        self.client.force_login(self.user)
+        data = {'shipping_address': 'street', 'shipping_country': 'DE',
+                'shipping_zip': '1', 'same_billing_address': 'on',
+                'payment_option': 'S'}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/checkout/', data)
+        self.assertRedirects(response, '/payment/stripe/',
+                             fetch_redirect_response=False)
+        updates = [query['sql'] for query in queries
+                   if query['sql'].startswith('UPDATE "core_order"')]
+        self.assertEqual(len(updates), 2)
+        for sql in updates:
+            self.assertNotIn('item_count', sql)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(order.billing_address.address_type, 'B')
+        self.assertSummary(1, 10)
+
+    @override_settings(ROOT_URLCONF='core.tests')
+    def test_add_from_product_page(self):
+        size = Variation.objects.create(item=self.item, name='size')
+        small = ItemVariation.objects.create(variation=size, value='S')
+        self.client.force_login(self.user)
+
+        self.client.get('/add-to-cart/item/', {'variation': small.pk})
+        self.assertEqual(
+            list(OrderItem.objects.get().item_variations.all()), [small])
+
+        # pages without the variation choices add the bare item
+        self.client.get('/add-to-cart/item/')
+        self.assertEqual(OrderItem.objects.count(), 2)
+        self.assertSummary(2, 20)
+
+
+class AddToCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+
+    def create_item(self, slug, variations, values=2):
+        """The item and the ids of its values, one list per variation."""
+        item = create_item(slug)
+        axes = []
+        for i in range(variations):
+            variation = Variation.objects.create(item=item, name=f'v{i}')
+            axes.append([ItemVariation.objects.create(
+                variation=variation, value=f'{j}').pk for j in range(values)])
+        return item, axes
+
+    def test_lines_match_by_variations(self):
+        item, (colors, sizes) = self.create_item('item', 2)
+
+        self.assertTrue(add_to_cart(self.user, item, [colors[0], sizes[0]]))
+        self.assertFalse(add_to_cart(self.user, item, [sizes[0], colors[0]]))
+        self.assertTrue(add_to_cart(self.user, item, [colors[0], sizes[1]]))
+
+        lines = OrderItem.objects.order_by('pk')
+        self.assertEqual([line.quantity for line in lines], [2, 1])
+        self.assertEqual(
+            set(lines[1].item_variations.values_list('pk', flat=True)),
+            {colors[0], sizes[1]})
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual((order.item_count, order.total), (2, 30))
+
+    def test_one_value_per_variation(self):
+        item, (colors, sizes) = self.create_item('item', 2)
+        other, (others,) = self.create_item('other', 1)
+
+        for ids in ([], [colors[0]], [colors[0], colors[1]],
+                    [colors[0], sizes[0], others[0]], ['x']):
+            with self.assertRaises(CartError, msg=ids):
+                add_to_cart(self.user, item, ids)
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_line_outside_the_cart_is_left_alone(self):
+        item, _ = self.create_item('item', 0)
+        orphan = OrderItem.objects.create(user=self.user, item=item)
+
+        self.assertTrue(add_to_cart(self.user, item))
+        orphan.refresh_from_db()
+        self.assertEqual(orphan.quantity, 1)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual([line.quantity for line in order.items.all()], [1])
+
+    def test_signature_follows_the_variations(self):
+        item, (colors, sizes) = self.create_item('item', 2)
+        add_to_cart(self.user, item, [colors[0], sizes[0]])
+        order_item = OrderItem.objects.get()
+
+        order_item.item_variations.remove(sizes[0])
+        order_item.refresh_from_db()
+        self.assertEqual(order_item.variation_signature,
+                         OrderItem.make_variation_signature([colors[0]]))
+
+        ItemVariation.objects.get(pk=colors[0]).orderitem_set.clear()
+        order_item.refresh_from_db()
+        self.assertEqual(order_item.variation_signature, '')
+
+    def test_query_count_does_not_depend_on_variations(self):
+        bare, _ = self.create_item('bare', 0)
+        add_to_cart(self.user, bare)
+
+        for variations in (1, 4):
+            item, axes = self.create_item(f'i{variations}', variations)
+            ids = [values[0] for values in axes]
+            # check, lock, probe, the line and its two M2M inserts, the
+            # summary, and the savepoint
+            with self.assertNumQueries(9):
+                self.assertTrue(add_to_cart(self.user, item, ids))
+            with self.assertNumQueries(6):
+                self.assertFalse(add_to_cart(self.user, item, ids))
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Runs a data migration on rows written with the models before it."""
+    migrate_from = migrate_to = None
+
+    def setUp(self):
+        self.apps = self.migrate_core(self.migrate_from)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate_core(self, name):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('core', name)])
+        return executor.loader.project_state([('core', name)]).apps
+
+
+class MergeOpenOrdersMigrationTests(MigrationTestCase):
+    migrate_from = '0010_orderitem_cart_line_index'
+    migrate_to = '0011_order_open_indexes'
+
+    def test_open_orders_are_merged(self):
+        User = self.apps.get_model('auth', 'User')
+        Order = self.apps.get_model('core', 'Order')
+        OrderItem = self.apps.get_model('core', 'OrderItem')
+        Coupon = self.apps.get_model('core', 'Coupon')
+
+        user = User.objects.create(username='user')
+        item = create_item(model=self.apps.get_model('core', 'Item'))
+        coupon = Coupon.objects.create(code='SAVE', amount=5)
+        now = timezone.now()
+        first = Order.objects.create(user=user, ordered_date=now)
+        second = Order.objects.create(user=user, ordered_date=now,
+                                      coupon=coupon)
+        for order in (first, second):
+            order.items.add(OrderItem.objects.create(user=user, item=item))
+
+        apps = self.migrate_core(self.migrate_to)
+        Order = apps.get_model('core', 'Order')
+        order = Order.objects.get(user=user.pk, ordered=False)
+        self.assertEqual(order.pk, first.pk)
+        self.assertEqual(order.coupon_id, coupon.pk)
+        self.assertEqual(
+            [line.quantity for line in order.items.all()], [2])
+        self.assertEqual((order.item_count, order.subtotal, order.total),
+                         (1, 20, 15))
+        self.assertEqual(
+            apps.get_model('core', 'OrderItem').objects.count(), 1)
+
+
+class VariationSignatureMigrationTests(MigrationTestCase):
+    migrate_from = '0009_orderitem_variation_signature'
+    migrate_to = '0010_orderitem_cart_line_index'
+
+    def test_signatures_and_orphans(self):
+        User = self.apps.get_model('auth', 'User')
+        Variation = self.apps.get_model('core', 'Variation')
+        ItemVariation = self.apps.get_model('core', 'ItemVariation')
+        Order = self.apps.get_model('core', 'Order')
+        Line = self.apps.get_model('core', 'OrderItem')
+
+        user = User.objects.create(username='user')
+        item = create_item(model=self.apps.get_model('core', 'Item'))
+        variation = Variation.objects.create(item=item, name='size')
+        values = [ItemVariation.objects.create(variation=variation, value=v)
+                  for v in ('S', 'L')]
+        order = Order.objects.create(user=user, ordered_date=timezone.now())
+        line = Line.objects.create(user=user, item=item)
+        line.item_variations.add(*values)
+        order.items.add(line)
+        Line.objects.create(user=user, item=item)  # not in any order
+        paid = Line.objects.create(user=user, item=item, ordered=True)
+
+        apps = self.migrate_core(self.migrate_to)
+        Line = apps.get_model('core', 'OrderItem')
+        self.assertEqual(set(Line.objects.values_list('pk', flat=True)),
+                         {line.pk, paid.pk})
+        self.assertEqual(
+            Line.objects.get(pk=line.pk).variation_signature,
+            OrderItem.make_variation_signature([v.pk for v in values]))
+
+
+class OpenOrderConstraintTests(TestCase):
+    def test_one_open_order_per_user(self):
+        user = User.objects.create(username='user')
+        Order.objects.create(user=user, ordered_date=timezone.now())
+        Order.objects.create(user=user, ordered_date=timezone.now(),
+                             ordered=True)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=user, ordered_date=timezone.now())
+
+
+class CartBadgeTests(TransactionTestCase):
+    def test_cache_cleared_once_committed(self):
+        user = User.objects.create(username='user')
+        # no image, committing would schedule its renditions
+        item = create_item(image='')
+        self.assertEqual(get_cart_item_count(user), 0)
+
+        with transaction.atomic():
+            add_to_cart(user, item)
+            # a read before the commit still gets the cached count
+            self.assertEqual(get_cart_item_count(User.objects.get()), 0)
+        self.assertEqual(get_cart_item_count(User.objects.get()), 1)
+
+
+class OrderTotalsTests(TestCase):
+    def test_totals_match_the_lines(self):
+        user = User.objects.create(username='user')
+        shirt = create_item('shirt')
+        cap = create_item('cap', price=5, discount_price=1.5)
+        for item in (shirt, cap, cap):
+            add_to_cart(user, item)
+        Order.objects.update(coupon=Coupon.objects.create(code='c', amount=2))
+
+        order = Order.objects.with_totals().get()
+        lines = Order.objects.get().items.all()
+        self.assertEqual(order.computed_subtotal,
+                         sum(line.get_total_item_price() for line in lines))
+        self.assertEqual(order.computed_discount, 3)
+        self.assertEqual(order.computed_subtotal - order.computed_discount,
+                         sum(line.get_final_price() for line in lines))
+        self.assertEqual(order.get_total(), Order.objects.get().get_total())
+        self.assertEqual(order.get_total(), 15)
+
+
+class FinalizeOrderTests(TestCase):
+    def test_statements_do_not_depend_on_lines(self):
+        user = User.objects.create(username='user')
+        for i in range(3):
+            item = create_item(f'i{i}')
+            add_to_cart(user, item)
+        order = Order.objects.get(user=user, ordered=False)
+        payment = Payment.objects.create(user=user, amount=30)
+        Order.objects.filter(pk=order.pk).update(payment=payment)
+
+        # the two UPDATEs and their savepoint
+        with self.assertNumQueries(4):
+            self.assertTrue(finalize_order(payment))
+        self.assertFalse(finalize_order(payment))
+
+        order.refresh_from_db()
+        self.assertTrue(order.ordered)
+        self.assertEqual(len(order.ref_code), 24)
+        self.assertFalse(order.items.filter(ordered=False).exists())
+
+
+@override_settings(PAYMENT_GATEWAY='core.gateway.FakeGateway',
+                   PAYMENT_JOBS_EAGER=False)
+class PaymentTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.user = User.objects.create(username='user',
+                                        email='user@example.com')
+        self.item = create_item()
+        add_to_cart(self.user, self.item)
+        self.order = Order.objects.get(user=self.user, ordered=False)
+
+    def charges(self):
+        return [call for call in get_gateway().calls if call[0] == 'charge']
+
+    def test_payment_finalizes_the_order(self):
+        payment = submit_payment(self.user, source='tok_visa')
+        self.assertEqual(payment.status, Payment.PENDING)
+        self.assertEqual(self.charges(), [])
+
+        self.assertEqual(process_pending_payments(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.SUCCEEDED)
+        self.assertEqual(payment.source, '')
+        self.assertTrue(payment.stripe_charge_id)
+        self.assertEqual(self.charges(), [('charge', 1000, None, 'tok_visa')])
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.ordered)
+        self.assertFalse(self.order.items.filter(ordered=False).exists())
+
+    def test_payment_is_charged_once(self):
+        payment = submit_payment(self.user, source='tok_visa')
+        Payment.objects.filter(pk=payment.pk).update(
+            status=Payment.PROCESSING, claimed_at=timezone.now())
+
+        # claimed by another worker
+        self.assertEqual(process_payment(payment.pk).status,
+                         Payment.PROCESSING)
+        self.assertEqual(process_pending_payments(), 0)
+        self.assertEqual(self.charges(), [])
+
+    def test_stale_claim_is_queued_again(self):
+        payment = submit_payment(self.user, source='tok_visa')
+        # the worker charged the card and died
+        get_gateway().charge(1000, source='tok_visa',
+                             idempotency_key=f'payment-{payment.pk}')
+        Payment.objects.filter(pk=payment.pk).update(
+            status=Payment.PROCESSING,
+            claimed_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(process_pending_payments(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.SUCCEEDED)
+        self.assertEqual(len(get_gateway().charges), 1)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).ordered)
+
+    def test_declined_card(self):
+        payment = submit_payment(self.user,
+                                 source='tok_chargeDeclined')
+        payment = process_payment(payment.pk)
+        self.assertEqual(payment.status, Payment.FAILED)
+        self.assertEqual(payment.failure_message, 'Your card was declined.')
+        self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+
+        # the cart is open again for another payment
+        add_to_cart(self.user, self.item)
+        submit_payment(self.user, source='tok_visa')
+        process_pending_payments()
+        self.assertTrue(Order.objects.get(pk=self.order.pk).ordered)
+
+    def test_card_is_saved(self):
+        payment = submit_payment(self.user, source='tok_visa',
+                                 use_customer=True, save_source=True)
+        process_payment(payment.pk)
+
+        userprofile = self.user.userprofile
+        userprofile.refresh_from_db()
+        self.assertTrue(userprofile.one_click_purchasing)
+        customer_id = userprofile.stripe_customer_id
+        self.assertEqual(self.charges(), [('charge', 1000, customer_id, None)])
+        self.assertEqual(len(get_gateway().cards[customer_id]), 1)
+
+    def test_new_card_of_a_customer_is_charged(self):
+        userprofile = self.user.userprofile
+        # the default card, declined if charged
+        userprofile.stripe_customer_id = get_gateway().create_customer(
+            self.user.email, 'tok_chargeDeclined')
+        userprofile.save()
+
+        payment = submit_payment(self.user, source='tok_visa',
+                                 use_customer=True, save_source=True)
+        payment = process_payment(payment.pk)
+        self.assertEqual(payment.status, Payment.SUCCEEDED)
+        card_id = get_gateway().cards[userprofile.stripe_customer_id][0]['id']
+        self.assertEqual(self.charges(), [
+            ('charge', 1000, userprofile.stripe_customer_id, card_id)])
+
+    def test_saved_cards_are_cached(self):
+        cache.clear()
+        userprofile = self.user.userprofile
+        userprofile.stripe_customer_id = get_gateway().create_customer(
+            self.user.email, 'tok_visa')
+        userprofile.save()
+        key = SAVED_CARDS_CACHE_KEY.format(userprofile.pk)
+
+        cards = get_saved_cards(userprofile)
+        self.assertEqual(len(cards), 1)
+        calls = len(get_gateway().calls)
+        self.assertEqual(get_saved_cards(userprofile), cards)
+        self.assertEqual(len(get_gateway().calls), calls)
+
+        # saving a card refreshes the cached ones
+        payment = submit_payment(self.user, source='tok_visa',
+                                 use_customer=True, save_source=True)
+        process_payment(payment.pk)
+        self.assertEqual(len(cache.get(key)), 2)
+
+        # without the gateway the next page view fetches them again
+        add_to_cart(self.user, self.item)
+        payment = submit_payment(self.user, source='tok_visa',
+                                 use_customer=True, save_source=True)
+        with mock.patch.object(get_gateway(), 'list_cards', side_effect=(
+                stripe.error.APIConnectionError('down'))):
+            process_payment(payment.pk)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(len(get_saved_cards(userprofile)), 3)
+
+    @override_settings(ROOT_URLCONF='core.tests', PAYMENT_JOBS_EAGER=True)
+    def test_payment_page_shows_the_outcome(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/payment/stripe/',
+                                    {'stripeToken': 'tok_chargeDeclined'})
+        response = self.client.get(response.url)
+        self.assertRedirects(response, '/checkout/',
+                             fetch_redirect_response=False)
+        self.assertEqual(
+            [str(m) for m in get_messages(response.wsgi_request)],
+            ['Your card was declined.'])
+
+        response = self.client.post('/payment/stripe/',
+                                    {'stripeToken': 'tok_visa'})
+        payment = Payment.objects.get(status=Payment.SUCCEEDED)
+        self.assertRedirects(response, f'/payment-status/{payment.pk}/',
+                             fetch_redirect_response=False)
+        self.assertRedirects(self.client.get(response.url), '/',
+                             fetch_redirect_response=False)
+
+    def test_cart_opened_concurrently_is_locked(self):
+        submit_payment(self.user, source='tok_visa')
+
+        # the open order is created by another request after the first look
+        real_lock_cart = cart.lock_cart
+        looks = iter([lambda **lookups: None, real_lock_cart])
+        with mock.patch('core.cart.lock_cart',
+                        side_effect=lambda **lookups: next(looks)(**lookups)):
+            with self.assertRaises(CartError):
+                add_to_cart(self.user, self.item)
+        self.assertEqual(OrderItem.objects.get().quantity, 1)
+
+    def test_second_submit_is_refused(self):
+        payment = submit_payment(self.user, source='tok_visa')
+        with self.assertRaises(PaymentError):
+            submit_payment(self.user, source='tok_other')
+
+        process_pending_payments()
+        self.assertEqual(len(self.charges()), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).payment, payment)
+
+    def test_cart_is_locked_while_paying(self):
+        submit_payment(self.user, source='tok_visa')
+        other = create_item('other', price=100)
+        with self.assertRaises(CartError):
+            add_to_cart(self.user, other)
+        with self.assertRaises(CartError):
+            remove_from_cart(self.user, self.item)
+
+        process_pending_payments()
+        self.assertEqual(self.charges(), [('charge', 1000, None, 'tok_visa')])
+        self.assertEqual(OrderItem.objects.get(user=self.user).item,
+                         self.item)
+
+    def test_changed_order_is_not_charged(self):
+        payment = submit_payment(self.user, source='tok_visa')
+        Payment.objects.filter(pk=payment.pk).update(amount=5)
+
+        payment = process_payment(payment.pk)
+        self.assertEqual(payment.status, Payment.FAILED)
+        self.assertEqual(self.charges(), [])
+        self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+
+
+@override_settings(PAYMENT_GATEWAY='core.gateway.FakeGateway',
+                   PAYMENT_JOBS_EAGER=False)
+class BenchmarkTests(TestCase):
+    def test_every_api_endpoint_is_benchmarked(self):
+        names = {pattern.name for pattern in api_urls.urlpatterns}
+        self.assertEqual(names,
+                         {endpoint.name for endpoint in benchmark.ENDPOINTS})
+
+    def test_endpoints_succeed_on_seeded_data(self):
+        fixture = benchmark.seed(users=2, items=3, variations=2, values=2,
+                                 cart_lines=2, orders=1)
+        results = benchmark.run(fixture, repeat=1)
+
+        for name, result in results.items():
+            self.assertLess(result['status'], 400, name)
+
+    def test_compare_reports_regressions(self):
+        result = {'status': 200, 'queries': 3, 'time_ms': 10.0,
+                  'memory_kb': 100.0}
+        baseline = {'endpoints': {'product_list': result}}
+
+        self.assertEqual(
+            benchmark.compare({'product_list': dict(result)}, baseline),
+            ([], []))
+        regressions, warnings = benchmark.compare(
+            {'product_list': dict(result, queries=4)}, baseline)
+        self.assertEqual((len(regressions), warnings), (1, []))
+        # timing is only advisory
+        regressions, warnings = benchmark.compare(
+            {'product_list': dict(result, time_ms=100.0)}, baseline)
+        self.assertEqual((regressions, len(warnings)), ([], 1))
+
+
+@override_settings(SQL_PROFILER_ENABLED=True, SQL_PROFILER_HEADERS=True)
+class QueryProfilerMiddlewareTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        profile_stats.reset()
+
+    def test_headers_and_totals_per_url_name(self):
+        item = create_item()
+
+        response = self.client.get(f'/api/products/{item.pk}/')
+        # the item and its (empty) variations
+        self.assertEqual(response['X-DB-Queries'], '2')
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+        self.assertIn('X-DB-Slowest-1', response)
+
+        stats = profile_stats.snapshot()['product_detail']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['queries'], 2)
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (1, 2)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'))
+        self.assertEqual(
+            fingerprint("SELECT 1 FROM t WHERE slug = 'a'  AND n = 2"),
+            'SELECT ? FROM t WHERE slug = ? AND n = ?')
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    def test_metrics_are_exported(self):
+        self.client.get('/api/countries/')
+
+        response = self.client.get('/metrics',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'django_request_latency_seconds_count{method="GET",'
+                      b'url_name="country_list"}', response.content)
+
+    def test_metrics_are_internal(self):
+        for header in ('', 'Bearer', 'Bearer other', 'secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION=header)
+            self.assertEqual(response.status_code, 404, header)
+        with self.settings(METRICS_TOKEN=''):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ')
+            self.assertEqual(response.status_code, 404)
+
+    @override_settings(PAYMENT_GATEWAY='core.gateway.FakeGateway')
+    def test_payment_worker_warns_without_multiprocess_dir(self):
+        stderr = StringIO()
+        call_command('process_payments', once=True, stderr=stderr)
+        self.assertIn('PROMETHEUS_MULTIPROC_DIR is not set', stderr.getvalue())
+
+
+# home.urls only routes the uploads when DEBUG is on
+@override_settings(ROOT_URLCONF='core.tests')
+class ServeMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        with open(os.path.join(self.media_root, 'item.jpg'), 'wb') as f:
+            f.write(b'jpeg')
+
+    def test_conditional_get(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            response = self.client.get('/media/item.jpg')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'jpeg')
+            self.assertIn('max-age', response['Cache-Control'])
+
+            response = self.client.get(
+                '/media/item.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_missing_and_outside_files(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            self.assertEqual(
+                self.client.get('/media/missing.jpg').status_code, 404)
+            self.assertEqual(
+                self.client.get('/media/../settings.py').status_code, 404)
+
+    @override_settings(ROOT_URLCONF='home.urls')
+    def test_not_served_in_production(self):
+        self.assertNotEqual(resolve('/media/item.jpg').url_name, 'media')
+
+
+@override_settings(IMAGE_RENDITIONS_EAGER=True,
+                   IMAGE_RENDITION_WIDTHS=[100, 400])
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def save_image(self, name, size):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (255, 0, 0, 128)).save(buffer, 'PNG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def create_item(self, name, size):
+        return create_item(image=self.save_image(name, size))
+
+    def renditions(self, item):
+        item.refresh_from_db()
+        return json.loads(item.image_renditions)
+
+    def test_renditions_are_never_upscaled(self):
+        item = self.create_item('item.png', (200, 50))
+
+        renditions = self.renditions(item)
+        self.assertEqual(renditions['source'], 'item.png')
+        for content_type in ('image/webp', 'image/jpeg'):
+            self.assertEqual(set(renditions[content_type]), {'100', '200'})
+        with default_storage.open(renditions['image/jpeg']['200']) as f:
+            self.assertEqual(Image.open(f).size, (200, 50))
+
+    def test_srcset(self):
+        item = self.create_item('item.png', (800, 400))
+
+        response = self.client.get(f'/api/products/{item.pk}/')
+        self.assertEqual(response.data['image_srcset'], {
+            'image/webp': 'http://testserver/media/item.100w.webp 100w, '
+                          'http://testserver/media/item.400w.webp 400w',
+            'image/jpeg': 'http://testserver/media/item.100w.jpg 100w, '
+                          'http://testserver/media/item.400w.jpg 400w',
+        })
+
+    def test_replaced_renditions_are_deleted(self):
+        item = self.create_item('old.png', (800, 400))
+        old = self.renditions(item)
+
+        item.image = self.save_image('new.png', (800, 400))
+        item.save()
+        new = self.renditions(item)
+        self.assertEqual(new['source'], 'new.png')
+        for content_type in ('image/webp', 'image/jpeg'):
+            for name in old[content_type].values():
+                self.assertFalse(default_storage.exists(name))
+            for name in new[content_type].values():
+                self.assertTrue(default_storage.exists(name))
+
+        item.image = ''
+        item.save()
+        item.refresh_from_db()
+        self.assertEqual(item.image_renditions, '')
+        for name in new['image/jpeg'].values():
+            self.assertFalse(default_storage.exists(name))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.client = APIClient()
+        self.item = create_item()
+
+    def assertNotModified(self, url, queries):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(queries):
+            response = self.client.get(url,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        return response['ETag']
+
+    def test_catalog(self):
+        for url in ('/api/products/', f'/api/products/{self.item.pk}/'):
+            etag = self.assertNotModified(url, 0)
+
+            self.item.title = 'renamed'
+            self.item.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_order_summary(self):
+        user = User.objects.create(username='user')
+        self.client.force_authenticate(user)
+        add_to_cart(user, self.item)
+
+        etag = self.assertNotModified('/api/order-summary/', 1)
+
+        add_to_cart(user, self.item)
+        response = self.client.get('/api/order-summary/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['order_items'][0]['quantity'], 2)
+
+    def test_countries(self):
+        etag = self.assertNotModified('/api/countries/', 0)
+        response = self.client.get('/api/countries/')
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(response.json()['DE'], 'Germany')
+
+
+@override_settings(PAYMENT_GATEWAY='core.gateway.FakeGateway',
+                   PAYMENT_JOBS_EAGER=False, IDEMPOTENCY_WAIT_TIMEOUT=0)
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        item = create_item()
+        add_to_cart(self.user, item)
+        address = Address.objects.create(
+            user=self.user, street_address='street', apartment_address='1',
+            country='DE', zip='1', address_type='B')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = {'stripeToken': 'tok_visa',
+                     'selectedBillingAddress': address.pk,
+                     'selectedShippingAddress': address.pk}
+
+    def checkout(self, data=None, key='key'):
+        return self.client.post('/api/checkout/', data or self.data,
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 202)
+
+        with self.assertNumQueries(1):
+            replay = self.checkout()
+        self.assertEqual(replay.status_code, 202)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.data, response.data)
+        self.assertEqual(Payment.objects.count(), 1)
+
+        self.assertEqual(self.checkout(key='other').status_code, 409)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_key_reused_for_another_request(self):
+        self.checkout()
+        response = self.checkout(dict(self.data, stripeToken='tok_other'))
+        self.assertEqual(response.status_code, 422)
+
+    def test_duplicate_of_a_request_in_flight(self):
+        self.checkout()
+        IdempotencyKey.objects.update(status_code=None)
+        self.assertEqual(self.checkout().status_code, 409)
+
+    def test_checkout_under_another_key(self):
+        payment = self.checkout().data
+        response = self.checkout(dict(self.data, stripeToken='tok_other'),
+                                 key='other')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['payment'], payment)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @override_settings(PAYMENT_GATEWAY='core.gateway.FakeGateway')
+    def test_payment_worker_purges_expired_keys(self):
+        self.checkout()
+        self.checkout(key='other')
+        IdempotencyKey.objects.filter(key='key').update(
+            created=timezone.now() - timedelta(days=2))
+
+        out = StringIO()
+        call_command('process_payments', once=True, stdout=out,
+                     stderr=StringIO())
+        self.assertIn('Deleted 1 expired idempotency key(s)', out.getvalue())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list('key', flat=True)),
+            ['other'])
+
+    # the HTML views aren't routed by home.urls
+    @override_settings(ROOT_URLCONF='core.tests')
+    def test_checkout_page_submitted_twice(self):
+        self.client.force_login(self.user)
+        for token in ('tok_visa', 'tok_other'):
+            response = self.client.post('/payment/stripe/',
+                                        {'stripeToken': token})
+        self.assertRedirects(response, '/checkout/',
+                             fetch_redirect_response=False)
+        self.assertEqual(Payment.objects.count(), 1)
+
+
+class ExportOrdersTests(TestCase):
+    def setUp(self):
+        item = create_item()
+        variation = Variation.objects.create(item=item, name='size')
+        item_variation = ItemVariation.objects.create(variation=variation,
+                                                      value='L')
+        for i in range(3):
+            user = User.objects.create(username=f'user{i}')
+            add_to_cart(user, item, [item_variation.pk])
+            payment = Payment.objects.create(user=user, amount=10,
+                                             status=Payment.SUCCEEDED)
+            Order.objects.filter(user=user).update(payment=payment)
+            finalize_order(payment)
+
+    def test_queries_per_chunk(self):
+        # orders, then lines, items and variations per chunk of two
+        with self.assertNumQueries(1 + 2 * 2):
+            rows = list(csv.reader(''.join(
+                export_orders(export_format='csv', chunk_size=2)
+            ).splitlines()))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][-1], '1 x item (size: L)')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_orders', format='jsonl', stdout=out,
+                     stderr=StringIO())
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record['user'] for record in records],
+                         ['user0', 'user1', 'user2'])
+        self.assertEqual(records[0]['payment']['status'], Payment.SUCCEEDED)
+        self.assertEqual(records[0]['lines'][0]['variations'], {'size': 'L'})
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'a@example.com',
+                                                   'password')
+        self.client.force_login(self.admin)
+        self.item = create_item()
+
+    def add_orders(self, count):
+        for i in range(count):
+            user = User.objects.create(username=f'user{User.objects.count()}')
+            add_to_cart(user, self.item)
+            address = Address.objects.create(
+                user=user, street_address='street', apartment_address='1',
+                country='DE', zip='1', address_type='B')
+            payment = Payment.objects.create(user=user, amount=10)
+            Order.objects.filter(user=user).update(
+                payment=payment, shipping_address=address,
+                billing_address=address)
+
+    def get_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_queries_do_not_depend_on_rows(self):
+        for url in ('/admin/core/order/', '/admin/core/address/'):
+            self.add_orders(1)
+            queries, _ = self.get_queries(url)
+            self.add_orders(4)
+            self.assertEqual(self.get_queries(url)[0], queries)
+
+    def test_total_column(self):
+        self.add_orders(1)
+        _, response = self.get_queries('/admin/core/order/?o=11')
+        self.assertContains(response, 'class="field-order_total">10.0<')
+
+
+class ImportCatalogTests(TestCase):
+    CSV = (
+        'slug,title,price,discount_price,category,label,description,image,'
+        'variation,value,attachment\n'
+        'shirt,Shirt,10,,S,P,A shirt,shirt.jpg,size,S,\n'
+        'shirt,Shirt,10,,S,P,A shirt,shirt.jpg,size,L,\n'
+        'shirt,Shirt,10,,S,P,A shirt,shirt.jpg,color,red,red.jpg\n'
+        'cap,Cap,5,4,OW,S,A cap,cap.jpg,,,\n'
+        'bad,Bad,ten,,S,P,,bad.jpg,,,\n'
+    )
+
+    def import_csv(self, text, batch_size=None):
+        results = list(import_catalog(read_csv(StringIO(text)), batch_size))
+        return [counts for counts, _ in results], [
+            error for _, errors in results for error in errors]
+
+    def test_upsert(self):
+        counts, errors = self.import_csv(self.CSV)
+        self.assertEqual(errors, ["bad: invalid price 'ten'"])
+        self.assertEqual(counts[0]['created'], 2)
+        self.assertEqual(counts[0]['values_created'], 3)
+        shirt = Item.objects.get(slug='shirt')
+        self.assertEqual(
+            sorted(ItemVariation.objects.filter(
+                variation__item=shirt).values_list(
+                    'variation__name', 'value', 'attachment')),
+            [('color', 'red', 'red.jpg'), ('size', 'L', ''),
+             ('size', 'S', '')])
+
+        user = User.objects.create(username='user')
+        add_to_cart(user, shirt, ItemVariation.objects.filter(
+            variation__item=shirt, value__in=['S', 'red']).values_list(
+                'pk', flat=True))
+        version = catalog_cache.item_version(shirt.pk)
+
+        # items, variations and values read once for the whole batch
+        with self.assertNumQueries(5):
+            counts, _ = self.import_csv(self.CSV)
+        self.assertEqual(counts[0]['unchanged'], 2)
+        self.assertEqual(catalog_cache.item_version(shirt.pk), version)
+
+        counts, _ = self.import_csv(self.CSV.replace(',10,', ',12,'))
+        self.assertEqual(counts[0]['updated'], 1)
+        self.assertEqual(Order.objects.get(user=user).total, 12)
+        self.assertNotEqual(catalog_cache.item_version(shirt.pk), version)
+
+    def test_batches(self):
+        counts, _ = self.import_csv(self.CSV, batch_size=2)
+        self.assertEqual([(c['created'], c['failed']) for c in counts],
+                         [(2, 0), (0, 1)])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl',
+                                         delete=False) as f:
+            f.write(json.dumps({
+                'slug': 'cap', 'title': 'Cap', 'price': 5, 'category': 'OW',
+                'label': 'S', 'description': '', 'image': 'cap.jpg',
+                'values': [{'variation': 'size', 'value': 'M'}],
+            }) + '\n')
+        self.addCleanup(os.remove, f.name)
+
+        out = StringIO()
+        call_command('import_catalog', f.name, stdout=out)
+        self.assertIn('1 items created', out.getvalue())
+        self.assertTrue(ItemVariation.objects.filter(
+            variation__item__slug='cap', value='M').exists())
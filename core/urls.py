@@ -34,6 +34,10 @@ urlpatterns = [
     path('payment/<payment_option>/', views.PaymentView.as_view(),
         name='payment'),
 
+    # outcome of a submitted payment
+    path('payment-status/<int:pk>/', views.PaymentStatusView.as_view(),
+        name='payment_status'),
+
     # add coupon
     path('add_coupon/', views.AddCoupon.as_view(), name='add_coupon'),
 
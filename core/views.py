@@ -1,22 +1,28 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.views.decorators.http import condition, require_safe
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, View
-from django.utils import timezone
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.conf import settings
-from django.db.models import Q
 
 
 from .models import (
     Order,
-    OrderItem,
     Item,
     Address,
-    Payment,
     Coupon,
+    Payment,
     Refund,
-    UserProfile,
 )
 from .forms import (
     CheckoutForm,
@@ -24,16 +30,9 @@ from .forms import (
     RefundForm,
     PaymentForm,
 )
-
-import stripe
-stripe.api_key = settings.API_SECRET_KEY
-
-import string
-import random
-
-
-def create_ref_code():
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=24))
+from .search import search_items
+from .payments import PaymentError, get_saved_cards, submit_payment
+from . import cart, catalog_cache, metrics
 
 
 
@@ -52,108 +51,103 @@ class ItemListView(ListView):
             queryset = queryset.filter(category=category.upper())
 
         if q:
-            query = (Q(title__icontains=q) | Q(description__icontains=q))
-            queryset = queryset.filter(query)
+            queryset = search_items(queryset, q)
 
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        if self.request.GET.get('q'):
+            return super().paginate_queryset(queryset, page_size)
+
+        # cache the items of the page along with the total count, which is
+        # all it takes to rebuild the paginator
+        def build():
+            paginator, page, object_list, is_paginated = super(
+                ItemListView, self).paginate_queryset(queryset, page_size)
+            return page.number, list(object_list), paginator.count
+
+        key = catalog_cache.list_key(self.request.get_full_path())
+        number, object_list, count = catalog_cache.get_or_set(key, build)
+
+        paginator = self.get_paginator(
+            range(count), page_size, orphans=self.get_paginate_orphans(),
+            allow_empty_first_page=self.get_allow_empty())
+        page = paginator.page(number)
+        page.object_list = object_list
+        return (paginator, page, object_list, page.has_other_pages())
+
 
 
 class ItemDetailView(DetailView):
     model = Item
     template_name = 'product.html'
 
+    def get_object(self, queryset=None):
+        # the slug of an item can change, the item is cached under its pk
+        # so other items changing leave it cached
+        slug = self.kwargs['slug']
+        pk = catalog_cache.get_or_set(
+            catalog_cache.list_key('product-pk:' + slug),
+            lambda: Item.objects.filter(slug=slug).order_by(
+                'pk').values_list('pk', flat=True).first())
+        if pk is None:
+            raise Http404
+        key = catalog_cache.item_key(pk, 'product')
+        return catalog_cache.get_or_set(
+            key, lambda: get_object_or_404(Item, pk=pk))
+
 
 
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(item=item,
-        user=request.user,
-        ordered=False)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request, "This item quantity was updated.")
-            return redirect('core:order_summary')
-        else:
-            messages.info(request, "This item was added to your cart.")
-            order_item.quantity = 1
-            order_item.save()
-            order.items.add(order_item)
-            return redirect('core:order_summary')
-    else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(user=request.user,
-            ordered_date=ordered_date)
-        order.items.add(order_item)
+    # the ItemVariation ids picked on the product page, the page links
+    # without any still add the bare item
+    variations = (request.POST.getlist('variation') or
+                  request.GET.getlist('variation'))
+
+    try:
+        created = cart.add_to_cart(request.user, item, variations,
+                                   require_variations=False)
+    except cart.CartError as e:
+        messages.info(request, str(e))
+        return redirect('core:product', slug=slug)
+
+    if created:
         messages.info(request, "This item was added to your cart.")
-        return redirect('core:order_summary')
+    else:
+        messages.info(request, "This item quantity was updated.")
+    return redirect('core:order_summary')
 
 
 
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
 
-    if order_qs.exists():
-        order = order_qs[0]
-
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            order.items.remove(order_item)
-            messages.info(request, "This item was removed from your cart.")
-            return redirect('core:product', slug=slug)
-        else:
-            messages.info(request, "This item was not in your cart.")
-            return redirect('core:product', slug=slug)
-    else:
-        messages.info(request, "You do not have an active order.")
+    try:
+        cart.remove_from_cart(request.user, item)
+    except cart.CartError as e:
+        messages.info(request, f'{e}.')
         return redirect('core:product', slug=slug)
 
+    messages.info(request, "This item was removed from your cart.")
+    return redirect('core:product', slug=slug)
+
 
 
 def remove_single_item_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
 
-    if order_qs.exists():
-        order = order_qs[0]
+    try:
+        deleted = cart.remove_from_cart(request.user, item, single=True)
+    except cart.CartError as e:
+        messages.info(request, f'{e}.')
+        return redirect('core:product', slug=slug)
 
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            if order_item.quantity == 1:
-                order.items.remove(order_item)
-                messages.info(request, "This item was removed from your cart.")
-                return redirect('core:order_summary')
-            elif order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-                messages.info(request, "This item quantity was updated.")
-                return redirect('core:order_summary')
-            else:
-                messages.info(request, "Operation failed.")
-                return redirect('core:order_summary')
-        else:
-            messages.info(request, "This item was not in your cart.")
-            return redirect('core:product', slug=slug)
+    if deleted:
+        messages.info(request, "This item was removed from your cart.")
     else:
-        messages.info(request, "You do not have an active order.")
-        return redirect('core:product', slug=slug)
+        messages.info(request, "This item quantity was updated.")
+    return redirect('core:order_summary')
 
 
 
@@ -162,7 +156,8 @@ class OrderSummaryView(LoginRequiredMixin, View):
 
     def get(self, request, *args, **kwargs):
         try:
-            order = Order.objects.get(user=request.user, ordered=False)
+            order = Order.objects.with_cart().get(user=request.user,
+                ordered=False)
             return render(request, 'order_summary.html', {'object': order})
         except ObjectDoesNotExist:
             messages.error(request, "You do not have an active order")
@@ -174,7 +169,8 @@ class CheckoutView(View):
     def get(self, request, *args, **kwargs):
         try:
             form = CheckoutForm()
-            order = Order.objects.get(user=request.user, ordered=False)
+            order = Order.objects.with_cart().get(user=request.user,
+                ordered=False)
             coupon_form = CouponForm()
 
             context = {
@@ -184,23 +180,23 @@ class CheckoutView(View):
                 'DISPLAY_COUPON_FORM': True,
             }
 
-            shipping_address_qs = Address.objects.filter(
+            default_shipping_address = Address.objects.filter(
                 user=request.user,
                 address_type='S',
                 default=True
-            )
-            if shipping_address_qs.exists():
+            ).first()
+            if default_shipping_address is not None:
                 context.update({
-                    'default_shipping_address': shipping_address_qs[0]
+                    'default_shipping_address': default_shipping_address
                 })
 
-            billing_address_qs = Address.objects.filter(
+            default_billing_address = Address.objects.filter(
                 user=request.user,
                 address_type='B',
                 default=True
-            )
-            if billing_address_qs.exists():
-                context.update({'default_billing_address': billing_address_qs[0]})
+            ).first()
+            if default_billing_address is not None:
+                context.update({'default_billing_address': default_billing_address})
 
             return render(request, 'checkout.html', context)
         except ObjectDoesNotExist:
@@ -221,16 +217,15 @@ class CheckoutView(View):
                 use_default_shipping = cd.get('use_default_shipping')
 
                 if use_default_shipping:
-                    address_qs = Address.objects.filter(
+                    shipping_address = Address.objects.filter(
                         user=request.user,
                         address_type='S',
                         default=True
-                    )
+                    ).first()
 
-                    if address_qs.exists():
-                        shipping_address = address_qs[0]
+                    if shipping_address is not None:
                         order.shipping_address = shipping_address
-                        order.save()
+                        order.save(update_fields=['shipping_address'])
                     else:
                         messages.info(request,
                             "No default shipping address available")
@@ -253,7 +248,7 @@ class CheckoutView(View):
                         )
 
                         order.shipping_address = shipping_address
-                        order.save()
+                        order.save(update_fields=['shipping_address'])
 
                         set_default_shipping = cd.get('set_default_shipping')
                         if set_default_shipping:
@@ -275,18 +270,17 @@ class CheckoutView(View):
                     billing_address.address_type = 'B'
                     billing_address.save()
                     order.billing_address = billing_address
-                    order.save()
+                    order.save(update_fields=['billing_address'])
                 elif use_default_billing:                    
-                    address_qs = Address.objects.filter(
+                    billing_address = Address.objects.filter(
                         user=request.user,
                         address_type='B',
                         default=True
-                    )
+                    ).first()
 
-                    if address_qs.exists():
-                        billing_address = address_qs[0]
+                    if billing_address is not None:
                         order.billing_address = billing_address
-                        order.save()
+                        order.save(update_fields=['billing_address'])
                     else:
                         messages.info(request,
                             "No default billing address available")
@@ -309,7 +303,7 @@ class CheckoutView(View):
                         )
 
                         order.billing_address = billing_address
-                        order.save()
+                        order.save(update_fields=['billing_address'])
 
                         set_default_billing = cd.get('set_default_billing')
 
@@ -342,7 +336,7 @@ class CheckoutView(View):
 
 class PaymentView(View):
     def get(self, request, *args, **kwargs):
-        order = Order.objects.get(user=request.user, ordered=False)
+        order = Order.objects.with_cart().get(user=request.user, ordered=False)
 
         if order.billing_address:
             context = {
@@ -353,13 +347,8 @@ class PaymentView(View):
             userprofile = request.user.userprofile
             if userprofile.one_click_purchasing:
                 # fetch the users card list
-                cards = stripe.Customer.list_sources(
-                    userprofile.stripe_customer_id,
-                    limit=3,
-                    object='card'
-                )
-                
-                card_list = cards['data']
+                card_list = get_saved_cards(userprofile)
+
                 if len(card_list) > 0:
                     # update the context with the default card
                     context.update({
@@ -373,102 +362,44 @@ class PaymentView(View):
 
 
     def post(self, request, *args, **kwargs):
-        order = Order.objects.get(user=request.user, ordered=False)
         form = PaymentForm(request.POST)
-        userprofile = UserProfile.objects.get(user=request.user)
 
         if form.is_valid():
             token = request.POST.get('stripeToken')
             save = request.POST.get('save')
             use_default = request.POST.get('use_default')
 
-            if save:
-                # allow to fetch cards
-                if not userprofile.stripe_customer_id:
-                    customer = stripe.Customer.create(
-                        email=request.user.email,
-                        source=token
-                    )
-
-                    userprofile.stripe_customer_id = customer['id']
-                    userprofile.one_click_purchasing = True
-                    userprofile.save()
-                else:
-                    stripe.Customer.create_source(
-                        userprofile.stripe_customer_id,
-                        source=token
-                    )
-
-            amount = int(order.get_total() * 100) # cents
-
+            # a token saved on the customer is used up, charge the customer
             try:
-                # Use Stripe's library to make requests
-                if use_default:
-                    charge = stripe.Charge.create(
-                        amount=amount, # cents
-                        currency='usd',
-                        customer=userprofile.stripe_customer_id
-                    )
-                else:
-                    charge = stripe.Charge.create(
-                        amount=amount, # cents
-                        currency='usd',
-                        source=token
-                    )
-
-                # create the payment
-                payment = Payment.objects.create(
-                    stripe_charge_id=charge['id'],
-                    user=request.user,
-                    amount=order.get_total()
-                )
-
-                order.ordered = True
-                order.payment = payment
-                order.ref_code = create_ref_code()
-                order.save()
-
-                order_items = order.items.all()
-                order_items.update(ordered=True)
-                for item in order_items:
-                    item.save()
-
-                messages.success(request, 'Your order was successful!')
-                return redirect('core:product_list')
+                payment = submit_payment(request.user,
+                    source=token,
+                    use_customer=bool(use_default or save),
+                    save_source=bool(save))
+            except PaymentError as e:
+                messages.warning(request, str(e))
+                return redirect('core:checkout')
 
-            except stripe.error.CardError as e:
-                # Since it's a decline, stripe.error.CardError will be caught
-                messages.warning(request, e.error.message)
-                return redirect('core:product_list')
+            return redirect('core:payment_status', pk=payment.pk)
 
-            except stripe.error.RateLimitError as e:
-                # Too many requests made to the API too quickly
-                messages.warning(request, "Rate limit error.")
-                return redirect('core:product_list')
 
-            except stripe.error.InvalidRequestError as e:
-                # Invalid parameters were supplied to Stripe's API
-                messages.warning(request, "Invalid parameters.")
-                return redirect('core:product_list')
+class PaymentStatusView(LoginRequiredMixin, View):
+    """Where the payment page sends the customer until the payment ran."""
 
-            except stripe.error.AuthenticationError as e:
-                # Authentication with Stripe's API failed
-                # (maybe you changed API keys recently)
-                messages.warning(request, "Not authenticated.")
-                return redirect('core:product_list')
+    def get(self, request, pk, *args, **kwargs):
+        payment = get_object_or_404(Payment, pk=pk, user=request.user)
 
-            except stripe.error.APIConnectionError as e:
-                # Network communication with Stripe failed
-                messages.warning(request, "Network error.")
-                return redirect('core:product_list')
+        if payment.status == Payment.SUCCEEDED:
+            messages.success(request, 'Your order was successful!')
+            return redirect('core:product_list')
+        if payment.status == Payment.FAILED:
+            messages.warning(request, payment.failure_message)
+            return redirect('core:checkout')
 
-            except stripe.error.StripeError as e:
-                messages.warning(request, "Something went wrong. You were not charged. Plase try again.")
-                return redirect('core:product_list')
-
-            except Exception as e:
-                messages.warning(request, "A serious error occurred. We have been notified.")
-                return redirect('core:product_list')
+        # the payment worker hasn't charged it yet, check again shortly
+        response = render(request, 'payment_status.html',
+                          {'payment': payment})
+        response['Refresh'] = '2'
+        return response
 
 
 
@@ -488,14 +419,12 @@ class AddCoupon(View):
         if form.is_valid():
             try:
                 code = form.cleaned_data.get('code')
-                order = Order.objects.get(user=request.user, ordered=False)
                 coupon = get_coupon(request, code)
-                order.coupon = coupon
-                order.save()
+                cart.apply_coupon(request.user, coupon)
                 messages.success(request, "Successfully added coupon.")
                 return redirect('core:checkout')
-            except ObjectDoesNotExist:
-                messages.info(request, "You do not have an active order")
+            except cart.CartError as e:
+                messages.info(request, f'{e}.')
                 return redirect('core:checkout')
         messages.warning(request, "Could not process the request!")
         return redirect("core:checkout")
@@ -526,7 +455,7 @@ class RequestRefundView(View):
             try:
                 order = Order.objects.get(ref_code=ref_code)
                 order.refund_requested = True
-                order.save()
+                order.save(update_fields=['refund_requested'])
 
                 # store the refund
                 refund = Refund()
@@ -552,5 +481,53 @@ class UserPanel(LoginRequiredMixin, ListView):
     template_name = 'user_panel.html'
 
     def get_queryset(self):
-        qs = Order.objects.filter(user=self.request.user, ordered=True)
+        qs = Order.objects.with_totals().filter(user=self.request.user,
+            ordered=True)
         return qs
+
+
+
+def metrics_view(request):
+    # internal, only served to the prometheus scrapers
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        raise Http404
+    content, content_type = metrics.render()
+    return HttpResponse(content, content_type=content_type)
+
+
+
+def media_stat(path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return full_path, stat
+
+
+def media_etag(request, path):
+    _, stat = media_stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+@require_safe
+@condition(etag_func=media_etag)
+def serve_media(request, path):
+    """Serve an uploaded file, answering 304 to a matching If-None-Match."""
+    full_path, stat = media_stat(path)
+    content_type, _ = mimetypes.guess_type(full_path)
+
+    response = FileResponse(open(full_path, 'rb'),
+                            content_type=content_type or
+                            'application/octet-stream')
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_cache_control(response, public=True,
+                        max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
@@ -0,0 +1,43 @@
+'''gunicorn settings, prometheus metrics are shared between the workers
+
+The process_payments worker writes to the same directory, start it with
+the production settings or the same PROMETHEUS_MULTIPROC_DIR.
+'''
+
+import os
+
+from decouple import config
+
+# every worker writes its samples there, see core.metrics. It has to be
+# set before prometheus_client is imported
+multiproc_dir = config('PROMETHEUS_MULTIPROC_DIR',
+                       default='/var/tmp/django-ecommerce/prometheus')
+for name in ('PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir'):
+    os.environ.setdefault(name, multiproc_dir)
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def on_starting(server):
+    # samples left by a previous run would add up with the new ones, the
+    # files of a running payment worker are kept. They're named
+    # <type>_<pid>.db
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for name in os.listdir(multiproc_dir):
+        pid = os.path.splitext(name)[0].rpartition('_')[2]
+        if pid.isdigit() and not is_running(int(pid)):
+            os.remove(os.path.join(multiproc_dir, name))
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
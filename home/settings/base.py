@@ -1,4 +1,5 @@
 import os
+from corsheaders.defaults import default_headers
 from decouple import config
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -28,8 +29,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.QueryProfilerMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -51,6 +55,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.cart',
             ],
         },
     },
@@ -69,6 +74,94 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 SITE_ID = 1
 
+# static files are served by whitenoise. Content hashed names, the ones of
+# the React build and the ones ManifestStaticFilesStorage adds, are cached
+# for good
+WHITENOISE_IMMUTABLE_FILE_TEST = r'\.[0-9a-f]{8,}\.(?:chunk\.)?\w+$'
+
+# media files are revalidated with their ETag once this many seconds old
+MEDIA_CACHE_MAX_AGE = 60 * 60
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+    },
+}
+
+# cache holding the serialized product list and detail responses, keys are
+# versioned so entries only need to expire to free space
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# seconds a user's cart badge count stays cached, cart changes clear it
+CART_CACHE_TIMEOUT = 60 * 60
+
+# payment gateway used by the payment worker, core.gateway.FakeGateway
+# charges nothing and is meant for tests and local development
+PAYMENT_GATEWAY = 'core.gateway.StripeGateway'
+
+# charge inside the checkout request instead of leaving the payment to
+# the process_payments worker
+PAYMENT_JOBS_EAGER = False
+
+# seconds after which a payment claimed by a worker that never finished
+# it is queued again. Charges carry an idempotency key, a charge made by
+# the lost worker isn't repeated
+PAYMENT_CLAIM_TIMEOUT = 5 * 60
+
+# seconds the summary of a customer's saved cards stays cached
+SAVED_CARDS_CACHE_TIMEOUT = 60 * 60
+
+# seconds a checkout Idempotency-Key is remembered, and how long a
+# duplicate request waits for the one in flight before giving up
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+
+# above this many rows the admin changelists show Postgres' row estimate
+# of their table rather than counting it
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# items written per transaction by the import_catalog command
+CATALOG_IMPORT_BATCH_SIZE = 1000
+
+# orders read per query by the order exports, see core.exports
+ORDER_EXPORT_CHUNK_SIZE = 2000
+
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
+
+# widths of the resized copies of the item images and variation
+# attachments, generated by core.images in IMAGE_RENDITION_WORKERS threads
+# after the upload, or inline when IMAGE_RENDITIONS_EAGER is set
+IMAGE_RENDITION_WIDTHS = [320, 640, 1024]
+IMAGE_RENDITION_QUALITY = 80
+IMAGE_RENDITION_WORKERS = 2
+IMAGE_RENDITIONS_EAGER = False
+
+# per request SQL profile, see core.middleware.QueryProfilerMiddleware.
+# Sent as X-DB-* response headers with SQL_PROFILER_HEADERS, logged to
+# the core.sql logger otherwise, as a warning for requests repeating a
+# statement or spending over SQL_PROFILER_SLOW_MS in the database
+SQL_PROFILER_ENABLED = True
+SQL_PROFILER_HEADERS = False
+SQL_PROFILER_SLOWEST = 3
+SQL_PROFILER_SLOW_MS = 100
+
+# bearer token the prometheus scrapers send to /metrics, behind the proxy
+# every request comes from loopback so the address can't tell them apart.
+# /metrics is not served without a token
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# seconds clients may reuse the country list, it only changes on deploys
+COUNTRY_LIST_MAX_AGE = 60 * 60 * 24
+
+# text search configuration used for the product search index
+SEARCH_CONFIG = 'english'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
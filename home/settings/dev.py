@@ -22,3 +22,8 @@ CORS_ORIGIN_WHITELIST = (
 
 STRIPE_PUBLIC_KEY = config('STRIPE_TEST_PUBLIC_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_TEST_SECRET_KEY')
+
+PAYMENT_GATEWAY = config('PAYMENT_GATEWAY', default=PAYMENT_GATEWAY)
+PAYMENT_JOBS_EAGER = config('PAYMENT_JOBS_EAGER', default=True, cast=bool)
+
+SQL_PROFILER_HEADERS = True
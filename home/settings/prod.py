@@ -17,6 +17,31 @@ DATABASES = {
     }
 }
 
+# shared between the gunicorn workers so cart changes clear it everywhere.
+# Holds a badge count and a saved card summary per active user, past
+# MAX_ENTRIES every set culls a third of the entries
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CACHE_LOCATION',
+                           default='/var/tmp/django-ecommerce/cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=100000,
+                                  cast=int),
+        },
+    },
+    # read on every catalog request, so kept in memory and shared by the
+    # workers: memcached evicts the least recently used responses on its
+    # own. Set CATALOG_CACHE_BACKEND=django_redis.cache.RedisCache and a
+    # redis:// CATALOG_CACHE_LOCATION to use a redis compatible server
+    'catalog': {
+        'BACKEND': config('CATALOG_CACHE_BACKEND',
+            default='django.core.cache.backends.memcached.MemcachedCache'),
+        'LOCATION': config('CATALOG_CACHE_LOCATION',
+                           default='127.0.0.1:11211'),
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -24,4 +49,35 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
-STATICFILES_STORAGE = 'whitenoise.django.GzipManifestStaticFilesStorage'
+# one JSON line per request from the SQL profiler
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.sql': {
+            'handlers': ['console'],
+            'level': config('SQL_PROFILER_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# the uploads under MEDIA_ROOT are served by nginx in production, e.g.
+#   location /media/ { alias /path/to/media/; expires 1h; }
+# home.urls only routes them to Django when DEBUG is on
+
+# content hashed names, gzip and brotli copies written by collectstatic
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# prometheus_client's multiprocess directory. The gunicorn workers and the
+# process_payments worker both write their samples there, so /metrics adds
+# up the gateway metrics recorded by the latter. prometheus_client reads
+# it from the environment once imported, gunicorn.conf.py uses the same
+# variable and default
+PROMETHEUS_MULTIPROC_DIR = config(
+    'PROMETHEUS_MULTIPROC_DIR', default='/var/tmp/django-ecommerce/prometheus')
+for name in ('PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir'):
+    os.environ.setdefault(name, PROMETHEUS_MULTIPROC_DIR)
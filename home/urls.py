@@ -1,8 +1,11 @@
+import re
+
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.views.generic import TemplateView
 from django.conf import settings
-from django.conf.urls.static import static
+
+from core.views import metrics_view, serve_media
 
 
 urlpatterns = [
@@ -11,13 +14,15 @@ urlpatterns = [
     path('rest-auth/registration/', include('rest_auth.registration.urls')),
     path('admin/', admin.site.urls),
     path('api/', include('core.api.urls')),
+    path('metrics', metrics_view, name='metrics'),
     # re_path(r'^.*', TemplateView.as_view(template_name='index.html')),
 ]
 
+# nginx serves the uploads in production
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
-
+    urlpatterns += [re_path(
+        r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+        serve_media, name='media')]
 
 if not settings.DEBUG:
     urlpatterns += [re_path(r'^.*',
@@ -21,3 +21,4 @@ export const ADDRESS_DELETE_URL = id => `${END_POINT}/addresses/${id}/delete/`
 export const COUNTRY_LIST_URL = `${END_POINT}/countries/`
 
 export const PAYMENT_LIST_URL = `${END_POINT}/payments/`
+export const PAYMENT_DETAIL_URL = id => `${END_POINT}/payments/${id}/`
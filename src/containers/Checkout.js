@@ -19,7 +19,8 @@ import {
     CHECKOUT_URL,
     ORDER_SUMNARY_URL,
     ADD_COUPON_URL,
-    ADDRESS_LIST_URL
+    ADDRESS_LIST_URL,
+    PAYMENT_DETAIL_URL
 } from '../constants'
 import {
     CardElement,
@@ -169,17 +170,23 @@ class CheckoutForm extends React.Component {
                     error: null
                 })
                 const { selectedBillingAddress, selectedShippingAddress } = this.state
+                // a resent token replays the first response instead of a new charge
                 authAxios.post(CHECKOUT_URL, {
                     stripeToken: result.token.id,
                     selectedBillingAddress, selectedShippingAddress
+                }, {
+                    headers: { 'Idempotency-Key': result.token.id }
                 })
                     .then(res => {
-                        this.setState({
-                            loading: false,
-                            success: true
-                        })
+                        this.handlePollPayment(res.data.id)
                     })
                     .catch(err => {
+                        // the order is already being paid, wait for that payment
+                        const { response } = err
+                        if (response && response.status === 409 && response.data.payment) {
+                            this.handlePollPayment(response.data.payment.id)
+                            return
+                        }
                         this.setState({
                             loading: false,
                             error: err
@@ -189,6 +196,32 @@ class CheckoutForm extends React.Component {
         })
     };
 
+    handlePollPayment = id => {
+        // the card is charged in the background, wait for the outcome
+        authAxios.get(PAYMENT_DETAIL_URL(id))
+            .then(res => {
+                if (res.data.status === 'S') {
+                    this.setState({
+                        loading: false,
+                        success: true
+                    })
+                } else if (res.data.status === 'F') {
+                    this.setState({
+                        loading: false,
+                        error: res.data.failure_message
+                    })
+                } else {
+                    setTimeout(() => this.handlePollPayment(id), 1000)
+                }
+            })
+            .catch(err => {
+                this.setState({
+                    loading: false,
+                    error: err
+                })
+            })
+    }
+
     handleFetchOrder = () => {
         this.setState({
             loading: true
@@ -30,16 +30,22 @@ class ProductList extends Component {
 
 
     componentDidMount() {
+        this.handleFetchProducts(PRODUCT_LIST_URL)
+    }
+
+
+    handleFetchProducts = url => {
         this.setState({
             loading: true
         })
 
-        axios.get(PRODUCT_LIST_URL)
+        axios.get(url)
             .then(res => {
-                this.setState({
-                    data: res.data,
+                this.setState(prevState => ({
+                    data: [...(prevState.data || []), ...res.data.results],
+                    next: res.data.next,
                     loading: false
-                })
+                }))
             }).catch(err => {
                 this.setState({
                     error: err
@@ -69,7 +75,7 @@ class ProductList extends Component {
 
 
     render() {
-        const { loading, error, data } = this.state
+        const { loading, error, data, next } = this.state
 
         return (
             <Container>
@@ -130,6 +136,12 @@ class ProductList extends Component {
                         </Item>
                     ))}
                 </Item.Group>
+
+                {next && (
+                    <Button basic fluid loading={loading} onClick={() => this.handleFetchProducts(next)}>
+                        Load more
+                    </Button>
+                )}
             </Container >
         )
     }